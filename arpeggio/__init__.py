@@ -11,8 +11,18 @@
 #######################################################################
 
 import re
+import copy
 import bisect
+import heapq
 import logging
+from collections import OrderedDict
+
+__version__ = "0.1-dev"
+
+# Version of the parser model. Must be changed when the parser model classes
+# or the analyses of the model (see Parser._init_model) are changed as built
+# models are cached (see arpeggio.peg).
+MODEL_FORMAT = 2
 
 logger = logging.getLogger('arpeggio')
 
@@ -21,6 +31,7 @@ DEFAULT_WS='\t\n\r '
 class ArpeggioError(Exception):
     '''Base class for arpeggio errors.'''
     def __init__(self, message):
+        super(ArpeggioError, self).__init__(message)
         self.message = message
     def __str__(self):
         return repr(self.message)
@@ -39,8 +50,9 @@ class SemanticError(ArpeggioError):
     
 class NoMatch(Exception):
     '''
-    Exception raised by the Match classes during parsing to indicate that the 
-    match is not successful.
+    Exception raised by the parser if the input can't be parsed.
+    During parsing NoMatch objects are only registered by the parser to keep
+    the information about the furthest failure (see Parser._nm_fail).
     '''
     def __init__(self, value, position, parser):
         self.value = value
@@ -48,6 +60,22 @@ class NoMatch(Exception):
         self.parser = parser
         self._up = True # By default when NoMatch is thrown we will go up the Parse Model Tree.
 
+    def __reduce__(self):
+        # Parser is not pickled (e.g. NoMatch sent from the worker process,
+        # see arpeggio.pool).
+        state = self.__dict__.copy()
+        del state['parser']
+        return (NoMatch, (self.value, self.position, None), state)
+
+
+# Returned by the parser expressions to indicate that the match is not 
+# successful. 
+FAIL = object()
+
+# Yielded by the parse generators after each slice of the sliced parse 
+# (see arpeggio.iterative.SlicedParse).
+SLICE = object()
+
 
 def flatten(_iterable):
     '''Flattening of python iterables.'''
@@ -68,6 +96,8 @@ class ParsingExpression(object):
     Root parser expression node will create non-terminal parser tree node while non-root
     node will create list of terminals and non-terminals.
     """
+    __slots__ = ('rule', 'root', 'nodes', 'memoize', 'regular', 'alias')
+
     def __init__(self, rule=None, root=False, nodes=None):
         '''
         @param rule - the name of the parser rule if this is the root of the parser rule.
@@ -76,13 +106,20 @@ class ParsingExpression(object):
                         parse tree during parsing.
         @param nodes - list of child parser expression nodes.
         '''
-        # Memoization. Every node cache the parsing results for the given input positions.
-        self.result_cache = {} # position -> parse tree
         self.nodes = nodes
         if nodes is None:
             self.nodes = [] # child expressions
         self.rule = rule
         self.root = root
+        # Should results of this expression be memoized? 
+        # See arpeggio.analysis.memo_analysis
+        self.memoize = True
+        # Regular expression used instead of the _parse method.
+        # See arpeggio.regular.regular_analysis
+        self.regular = None
+        # The name of the pass-through rule this rule is parsed in place of.
+        # See arpeggio.optimize
+        self.alias = None
     
     @property
     def desc(self):
@@ -103,28 +140,35 @@ class ParsingExpression(object):
             return id(self)        
                 
     def _parse_intro(self, parser):
-        logger.debug("Parsing %s" % self.name)
-        results = []
-        parser._skip_ws()
-        self.c_pos = parser.position
+        if parser.position != parser._ws_end:
+            parser._skip_ws()
         
     def parse(self, parser):
         self._parse_intro(parser)
+        c_pos = parser.position
 
         #Memoization.
         #If this position is already parsed by this parser expression than use 
         #the result
-        if self.result_cache.has_key(self.c_pos):
-            logger.debug("Result for [%s, %s] founded in result_cache." % (self, self.c_pos))
-            result, new_pos =  self.result_cache[self.c_pos]
-            parser.position = new_pos
-            return result
+        if self.memoize:
+            cached = parser.memo.get(self, c_pos)
+            if cached is not None:
+                result, new_pos = cached
+                parser.position = new_pos
+                return result
 
         # We are descending down
         if parser.nm:
             parser.nm._up = False
             
-        result = self._parse(parser)
+        if self.regular is not None and parser._regular:
+            result = self.regular.parse(parser)
+        else:
+            result = self._parse(parser)
+        if result is FAIL:
+            if self.alias is not None:
+                self._nm_alias(parser.nm, c_pos)
+            return result
         
         if result:
             if parser.reduce_tree:
@@ -132,34 +176,47 @@ class ParsingExpression(object):
                     if self.root:
                         result = flatten(result)
                         if len(result)>1:
-                            result = NonTerminal(self.rule, self.c_pos, result)
+                            result = NonTerminal(self.rule, c_pos, result)
                         else:
                             result = result[0]
             else:
                 if self.root:
-                    result = NonTerminal(self.rule, self.c_pos, result)
+                    result = NonTerminal(self.rule, c_pos, result)
             
         # Result caching for use by memoization.
-        self.result_cache[self.c_pos] = (result, parser.position)
+        if self.memoize:
+            parser.memo.put(self, c_pos, result, parser.position)
         
         return result
 
     #TODO: _nm_change_rule should be called from every parser expression parse
     #         method that can potentialy be the root parser rule.
-    def _nm_change_rule(self, nm, parser):
+    def _nm_change_rule(self, nm, c_pos):
         '''
         Change rule for the given NoMatch object to a more generic if 
         we did not consume any input and we are moving up the parser model tree.
         Used to report most generic language element expected at the place of 
         the NoMatch exception.
+        @param c_pos - position where this expression started matching.
         '''
-        if self.root and self.c_pos == nm.position and nm._up:
+        if self.root and c_pos == nm.position and nm._up:
             nm.value = self.rule
+
+    def _nm_alias(self, nm, c_pos):
+        '''
+        Change rule for the given NoMatch object as the pass-through rule 
+        this rule is parsed in place of would when it fails (see 
+        arpeggio.optimize).
+        '''
+        if nm is not None and c_pos == nm.position and nm._up:
+            nm.value = self.alias
         
 class Sequence(ParsingExpression):
     '''
     Will match sequence of parser expressions in exact order they are defined.
     '''
+    __slots__ = ('elements',)
+
     def __init__(self, elements=None, rule=None, root=False, nodes=None):
         '''
         @param elements - list used as a stageing structure for python based grammar definition.
@@ -169,15 +226,15 @@ class Sequence(ParsingExpression):
         self.elements = elements
         
     def _parse(self, parser):
+        c_pos = parser.position
         results = []
-        try:
-            for e in self.nodes:
-                result = e.parse(parser)
-                if result:
-                    results.append(result)
-        except NoMatch, m:
-            self._nm_change_rule(m, parser)
-            raise
+        for e in self.nodes:
+            result = e.parse(parser)
+            if result is FAIL:
+                self._nm_change_rule(parser.nm, c_pos)
+                return result
+            if result:
+                results.append(result)
         
         return results
     
@@ -187,30 +244,52 @@ class OrderedChoice(Sequence):
     Will match one of the parser expressions specified. Parser will try to 
     match expressions in the order they are defined.
     '''
+    __slots__ = ('first_table', 'first_default', 'skip_down')
+
+    def __init__(self, *args, **kwargs):
+        super(OrderedChoice, self).__init__(*args, **kwargs)
+        # Prediction tables. See arpeggio.analysis.first_analysis
+        self.first_table = None     # character -> tuple of flags, one per 
+                                    # alternative, True if it can match
+        self.first_default = None   # flags for characters not in the table
+        self.skip_down = None       # flags, True if the failure of the 
+                                    # alternative would set NoMatch._up to False
+
     def _parse(self, parser):
-        result = None
-        match = False
-        for e in self.nodes:
-            try:
-                result = e.parse(parser)
-                match = True
-            except NoMatch, m:
-                parser.position = self.c_pos # Backtracking
-                self._nm_change_rule(m, parser)
-            else:
-                break
-        
-        if not match: 
-            parser.position = self.c_pos # Backtracking
-            raise parser.nm
+        c_pos = parser.position
 
-        return result
+        # Try only alternatives that can start with the current character.
+        predict = None
+        if self.first_table is not None and c_pos < len(parser.input):
+            predict = self.first_table.get(parser.input[c_pos], self.first_default)
+
+        for i, e in enumerate(self.nodes):
+            if predict is not None and not predict[i] and parser.nm is not None \
+                    and parser.nm.position >= c_pos:
+                # Alternative would fail at the current position without
+                # registering new NoMatch. Apply the effects its failure 
+                # would have on the last NoMatch.
+                # If the last NoMatch is behind the current position the 
+                # alternative is tried to register NoMatch properly.
+                if self.skip_down[i]:
+                    parser.nm._up = False
+                self._nm_change_rule(parser.nm, c_pos)
+                continue
+            result = e.parse(parser)
+            if result is not FAIL:
+                return result
+            parser.position = c_pos # Backtracking
+            self._nm_change_rule(parser.nm, c_pos)
+        
+        return FAIL
     
 
 class Repetition(ParsingExpression):
     '''
     Base class for all repetition-like parser expressions (?,*,+)
     '''
+    __slots__ = ('elements',)
+
     def __init__(self, *elements, **kwargs):
         super(Repetition, self).__init__(None)
         if len(elements)==1:
@@ -228,13 +307,14 @@ class Optional(Repetition):
     Optional will try to match parser expression specified buy will not fail in
     case match is not successful.
     '''
+    __slots__ = ()
+
     def _parse(self, parser):
-        result = None
-        try:
-            result = self.nodes[0].parse(parser)
-        except NoMatch:
-            parser.position = self.c_pos # Backtracking
-            pass
+        c_pos = parser.position
+        result = self.nodes[0].parse(parser)
+        if result is FAIL:
+            parser.position = c_pos # Backtracking
+            result = None
         
         return result
 
@@ -243,15 +323,17 @@ class ZeroOrMore(Repetition):
     ZeroOrMore will try to match parser expression specified zero or more times.
     It will never fail.
     '''
+    __slots__ = ()
+
     def _parse(self, parser):
         results = []
         while True:
-            try:
-                self.c_pos = parser.position
-                results.append(self.nodes[0].parse(parser))
-            except NoMatch:
-                parser.position = self.c_pos # Backtracking
+            c_pos = parser.position
+            result = self.nodes[0].parse(parser)
+            if result is FAIL:
+                parser.position = c_pos # Backtracking
                 break
+            results.append(result)
         
         return results
 
@@ -259,19 +341,19 @@ class OneOrMore(Repetition):
     '''
     OneOrMore will try to match parser expression specified one or more times.
     '''
+    __slots__ = ()
+
     def _parse(self, parser):
         results = []
-        first = False
         while True:
-            try:
-                self.c_pos = parser.position
-                results.append(self.nodes[0].parse(parser))
-                first = True
-            except NoMatch:
-                parser.position = self.c_pos # Backtracking
-                if not first:
-                    raise
+            c_pos = parser.position
+            result = self.nodes[0].parse(parser)
+            if result is FAIL:
+                parser.position = c_pos # Backtracking
+                if not results:
+                    return result
                 break
+            results.append(result)
         
         return results
 
@@ -281,6 +363,8 @@ class SyntaxPredicate(ParsingExpression):
     Predicates are parser expressions that will do the match but will not consume
     any input.
     '''
+    __slots__ = ('elements',)
+
     def __init__(self, *elements, **kwargs):
         if len(elements)==1:
             elements = elements[0]
@@ -297,34 +381,42 @@ class And(SyntaxPredicate):
     '''
     This predicate will succeed if the specified expression matches current input.
     '''
+    __slots__ = ()
+
     def _parse(self, parser):
+        c_pos = parser.position
         for e in self.nodes:
-            try:
-                e.parse(parser)
-            except NoMatch:
-                parser.position = self.c_pos
-                raise        
-        parser.position = self.c_pos
+            if e.parse(parser) is FAIL:
+                parser.position = c_pos
+                return FAIL
+        if parser.position > parser._examined:
+            parser._examined = parser.position
+        parser.position = c_pos
                 
 
 class Not(SyntaxPredicate):
     '''
     This predicate will succeed if the specified expression doesn't match current input.
     '''
+    __slots__ = ()
+
     def _parse(self, parser):
+        c_pos = parser.position
         for e in self.nodes:
-            try:
-                e.parse(parser)
-            except NoMatch:
-                parser.position = self.c_pos
+            if e.parse(parser) is FAIL:
+                parser.position = c_pos
                 return
-        parser.position = self.c_pos
-        parser._nm_raise(self.name, self.c_pos, parser)
+        if parser.position > parser._examined:
+            parser._examined = parser.position
+        parser.position = c_pos
+        return parser._nm_fail(self.name, c_pos)
 
 class Match(ParsingExpression):
     '''
     Base class for all classes that will try to match something from the input.
     '''
+    __slots__ = ('to_match',)
+
     def __init__(self, rule, root=False):
         super(Match,self).__init__(rule, root)
 
@@ -336,31 +428,19 @@ class Match(ParsingExpression):
         self._parse_intro(parser)
         if parser._in_parse_comment:
             return self._parse(parser)
-        comments = []
-        try:    
-            match = self._parse(parser)
-        except NoMatch, nm:
-            # If not matched try to match comment
-            #TODO: Comment handling refactoring. Should think of better way to
-            # handle comments.
-            if parser.comments_model:
+        match = self._parse(parser)
+        if match is FAIL and parser.comments_model:
+            # If not matched skip comments and try terminal match again
+            comments = parser._skip_comments()
+            if comments is not None:
+                # Failure after the comments is not registered as NoMatch.
+                parser._in_parse_comment = True
                 try:
-                    parser._in_parse_comment = True        
-                    while True:
-                        comments.append(parser.comments_model.parse(parser))
-                        parser._skip_ws()
-                except NoMatch:
-                    # If comment match successfull try terminal match again
-                    if comments:
-                        match = self._parse(parser)                    
-                        match.comments = NonTerminal('comment', self.c_pos, comments)
-                    else:
-                        parser._nm_raise(nm)
+                    match = self._parse(parser)
                 finally:
-                    parser._in_parse_comment = False        
-                    
-            else:
-                parser._nm_raise(nm)
+                    parser._in_parse_comment = False
+                if match is not FAIL:
+                    match = match.with_comments(comments)
             
         return match
             
@@ -369,6 +449,8 @@ class RegExMatch(Match):
     '''
     This Match class will perform input matching based on Regular Expressions.
     '''
+    __slots__ = ('regex',)
+
     def __init__(self, to_match, rule=None, flags=None):
         '''
         @param to_match - regular expression string to match.
@@ -381,19 +463,21 @@ class RegExMatch(Match):
             self.regex = re.compile(to_match)
 
     def _parse(self, parser):
-        m = self.regex.match(parser.input[parser.position:])
+        c_pos = parser.position
+        m = self.regex.match(parser.input, c_pos)
         if m:
-            parser.position += len(m.group())
-            logger.debug("Match %s at %d" % (m.group(), self.c_pos))
-            return Terminal(self.rule if self.root else '', self.c_pos, m.group())
+            parser.position = m.end()
+            return LazyTerminal(self.rule if self.root else '', c_pos, 
+                                parser.position, parser.input)
         else:
-            logger.debug("NoMatch at %d" % self.c_pos)
-            parser._nm_raise(self.root if self.root else self.name, self.c_pos, parser)
+            return parser._nm_fail(self.root if self.root else self.name, c_pos)
 
 class StrMatch(Match):
     '''
     This Match class will perform input matching by a string comparison.
     '''
+    __slots__ = ()
+
     def __init__(self, to_match, rule=None, root=False):
         '''
         @param to_match - string to match.
@@ -402,13 +486,13 @@ class StrMatch(Match):
         self.to_match = to_match
 
     def _parse(self, parser):
-        if parser.input[parser.position:].startswith(self.to_match):
+        c_pos = parser.position
+        if parser.input.startswith(self.to_match, c_pos):
             parser.position += len(self.to_match)
-            logger.debug("Match %s at %d" % (self.to_match, self.c_pos))
-            return Terminal(self.rule if self.root else '', self.c_pos, self.to_match)
+            return Terminal(self.rule if self.root else '', c_pos, 
+                            self.to_match, False, parser.position)
         else:
-            logger.debug("NoMatch at %d" % self.c_pos)
-            parser._nm_raise(self.to_match, self.c_pos, parser)
+            return parser._nm_fail(self.to_match, c_pos)
 
     def __str__(self):
         return self.to_match
@@ -423,6 +507,8 @@ class Kwd(StrMatch):
     '''
     Specialization of StrMatch to specify keywords of the language.
     '''
+    __slots__ = ()
+
     def __init__(self, to_match):
         super(Kwd, self).__init__(to_match, rule=None)
         self.to_match = to_match
@@ -433,6 +519,8 @@ class EndOfFile(Match):
     '''
     Match class that will succeed in case end of input is reached.
     '''
+    __slots__ = ()
+
     def __init__(self, rule=None):
         super(EndOfFile, self).__init__(rule)
 
@@ -441,11 +529,12 @@ class EndOfFile(Match):
         return "EOF"
 
     def _parse(self, parser):
-        if len(parser.input) == parser.position:
-            return Terminal(self.rule if self.root else '', self.c_pos, 'EOF')
+        c_pos = parser.position
+        if c_pos == len(parser.input):
+            return Terminal(self.rule if self.root else '', c_pos, 'EOF', 
+                            False, c_pos)
         else:
-            logger.debug("EOF not matched.")
-            parser._nm_raise(self.name, self.c_pos, parser)
+            return parser._nm_fail(self.name, c_pos)
         
 
 def EOF():      return EndOfFile()
@@ -460,7 +549,13 @@ class ParseTreeNode(object):
     '''
     Abstract base class representing node of the Parse Tree.
     The node can be terminal(the leaf of the parse tree) or non-terminal.
+    Nodes are kept in slots as parse trees of large inputs have a lot of them.
     '''
+    __slots__ = ('type', 'position', 'error')
+
+    # Comments matched before the node. Kept only by CommentedTerminal.
+    comments = None
+
     def __init__(self, type, position, error):
         '''
         @param type - the name of the rule that created this node or empty string in case
@@ -471,7 +566,6 @@ class ParseTreeNode(object):
         self.type = type
         self.position = position
         self.error = error
-        self.comments = None
     
     @property
     def name(self):
@@ -480,13 +574,30 @@ class ParseTreeNode(object):
 class Terminal(ParseTreeNode):
     '''
     Leaf node of the Parse Tree. Represents matched string.
+    The matched string spans the input from position to end.
     '''
-    def __init__(self, type, position, value, error=False):
+    __slots__ = ('value', 'end')
+
+    # Input stream the value is a slice of. Kept only by LazyTerminal.
+    _input = None
+
+    def __init__(self, type, position, value, error=False, end=None):
         '''
         @param value - matched string or missing token name in case of an error node.
+        @param end - position in the input stream after the match. By default
+                        the position after the value.
         '''
         super(Terminal, self).__init__(type, position, error)
         self.value = value
+        if end is None:
+            end = position + len(value)
+        self.end = end
+
+    def _keep_value(self):
+        '''
+        Makes the value independent of the input so the input can be
+        released.
+        '''
     
     @property
     def desc(self):
@@ -497,12 +608,74 @@ class Terminal(ParseTreeNode):
     
     def __eq__(self, other):
         return str(self)==str(other)
+
+    def with_comments(self, comments):
+        '''
+        Returns the copy of this terminal with the given comments.
+        '''
+        return CommentedTerminal(self.type, self.position, self.value, 
+                                 comments, self.error, self.end)
+
+
+class LazyTerminal(Terminal):
+    '''
+    Terminal matched in the input. Value is sliced from the input when it is
+    read so the terminals whose values are never read don't allocate them.
+    '''
+    __slots__ = ()
+
+    # The value slot of the terminal keeps the input.
+    _input = Terminal.value
+
+    def __init__(self, type, position, end, input):
+        '''
+        @param input - input stream the terminal is matched in.
+        '''
+        ParseTreeNode.__init__(self, type, position, False)
+        self.end = end
+        self._input = input
+
+    @property
+    def value(self):
+        return self._input[self.position:self.end]
+
+    @value.setter
+    def value(self, value):
+        # Assigned value replaces the input in the value slot.
+        self.__class__ = Terminal
+        self.value = value
+
+    def _keep_value(self):
+        self.value = self.value
+
+    def __reduce__(self):
+        # Pickled with the value and not with the whole input.
+        return (Terminal, (self.type, self.position, self.value, self.error,
+                           self.end))
+
+
+class CommentedTerminal(Terminal):
+    '''
+    Terminal preceded by comments.
+    '''
+    __slots__ = ('comments',)
+
+    def __init__(self, type, position, value, comments, error=False, 
+                 end=None):
+        '''
+        @param comments - NonTerminal with the comments.
+        '''
+        super(CommentedTerminal, self).__init__(type, position, value, error,
+                                                end)
+        self.comments = comments
             
 
 class NonTerminal(ParseTreeNode):
     '''
     Non-leaf node of the Parse Tree. Represents language syntax construction.
     '''
+    __slots__ = ('nodes',)
+
     def __init__(self, type, position, nodes, error=False):
         '''
         @param nodes - child ParseTreeNode
@@ -513,6 +686,127 @@ class NonTerminal(ParseTreeNode):
     @property
     def desc(self):
         return self.name
+
+    @property
+    def end(self):
+        '''
+        Position in the input stream after the last terminal of the node.
+        '''
+        node = self
+        while isinstance(node, NonTerminal) and node.nodes:
+            node = node.nodes[-1]
+        if isinstance(node, Terminal):
+            return node.end
+        return node.position
+
+
+# Slots of the parse tree nodes given by the properties of the subclasses.
+_position_slot = ParseTreeNode.position
+_end_slot = Terminal.end
+
+
+class _IncrementalNode(object):
+    '''
+    Mixin of the parse tree nodes kept by IncrementalMemo. Edits of the 
+    input made after the node is created are applied to its position when 
+    it is read so the nodes after the edit are not visited by reparse.
+    The position slot keeps (position, edits, the number of edits applied)
+    where edits is the list of (start, old length, new length, lookahead) 
+    of IncrementalMemo.
+    '''
+    __slots__ = ()
+
+    @property
+    def position(self):
+        position, edits, applied = _position_slot.__get__(self)
+        if applied == len(edits):
+            return position
+        new_position = position
+        for start, old_len, new_len, lookahead in edits[applied:]:
+            if new_position >= start + old_len:
+                new_position += new_len - old_len
+        _position_slot.__set__(self, (new_position, edits, len(edits)))
+        if isinstance(self, Terminal):
+            _end_slot.__set__(self, _end_slot.__get__(self) + 
+                              new_position - position)
+        return new_position
+
+    @position.setter
+    def position(self, position):
+        # Applies the edits to the end of the terminal.
+        self.position
+        edits = _position_slot.__get__(self)[1]
+        _position_slot.__set__(self, (position, edits, len(edits)))
+
+    @property
+    def end(self):
+        self.position
+        return _end_slot.__get__(self)
+
+    @end.setter
+    def end(self, end):
+        self.position
+        _end_slot.__set__(self, end)
+
+
+class IncrementalTerminal(_IncrementalNode, Terminal):
+    __slots__ = ()
+
+    def __reduce__(self):
+        return (Terminal, (self.type, self.position, self.value, self.error,
+                           self.end))
+
+
+class IncrementalCommentedTerminal(_IncrementalNode, CommentedTerminal):
+    __slots__ = ()
+
+    def __reduce__(self):
+        return (CommentedTerminal, (self.type, self.position, self.value, 
+                                    self.comments, self.error, self.end))
+
+
+class IncrementalNonTerminal(_IncrementalNode, NonTerminal):
+    __slots__ = ()
+
+    # Position after the last terminal (see NonTerminal)
+    end = NonTerminal.end
+
+    def __reduce__(self):
+        return (NonTerminal, (self.type, self.position, self.nodes, 
+                              self.error))
+
+
+# Parse tree node class -> the class of the node kept by IncrementalMemo
+_INCREMENTAL_CLASSES = {
+    Terminal: IncrementalTerminal,
+    CommentedTerminal: IncrementalCommentedTerminal,
+    NonTerminal: IncrementalNonTerminal,
+}
+
+
+def _shift_positions(result, offset):
+    '''
+    Adds offset to the positions of all parse tree nodes in the given result.
+    Each node is shifted once even if it is reachable more than once.
+    Values of the terminals are no longer slices of the input even if the
+    offset is 0 as the input may be dropped later.
+    '''
+    visited = set()
+    to_visit = [result]
+    while to_visit:
+        node = to_visit.pop()
+        if isinstance(node, list):
+            to_visit.extend(node)
+        elif isinstance(node, ParseTreeNode) and id(node) not in visited:
+            visited.add(id(node))
+            if isinstance(node, NonTerminal):
+                to_visit.extend(node.nodes)
+            else:
+                node._keep_value()
+                node.end += offset
+            node.position += offset
+            if node.comments is not None:
+                to_visit.append(node.comments)
     
     
 # ----------------------------------------------------
@@ -536,41 +830,683 @@ class SemanticAction(object):
         '''
         raise NotImplementedError()
     
+# ----------------------------------------------------
+# Memoization tables
+#
+# Memoization table is created by the parser at the beginning of each parse
+# and released when the parse is finished. The parser is given a factory
+# (e.g. a class) used to create the table so different eviction policies
+# can be plugged in, e.g.:
+#   ParserPython(calc, memo=lambda: LRUMemo(max_entries=5000))
+
+class Memo(object):
+    '''
+    Unbounded memoization table. Keeps the results of all parser expressions
+    for all input positions until the parse is finished.
+    '''
+    def __init__(self):
+        self._results = {}  # (expression id, position) -> (result, new position)
+
+    def get(self, expression, position):
+        '''
+        Returns (result, new position) tuple or None if the result of the given
+        expression at the given position is not memoized.
+        '''
+        return self._results.get((id(expression), position))
+
+    def put(self, expression, position, result, new_position):
+        self._results[(id(expression), position)] = (result, new_position)
+
+    def __len__(self):
+        return len(self._results)
+
+
+class LRUMemo(Memo):
+    '''
+    Memoization table bounded by the number of entries. Least recently used
+    entries are evicted first.
+    '''
+    def __init__(self, max_entries=10000):
+        '''
+        @param max_entries - maximal number of memoized results.
+        '''
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+
+    def get(self, expression, position):
+        key = (id(expression), position)
+        entry = self._results.pop(key, None)
+        if entry is not None:
+            self._results[key] = entry
+        return entry
+
+    def put(self, expression, position, result, new_position):
+        key = (id(expression), position)
+        self._results.pop(key, None)
+        self._results[key] = (result, new_position)
+        if len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+
+class WindowMemo(Memo):
+    '''
+    Memoization table which keeps only the results for the positions inside
+    the sliding window behind the furthest position reached by the parser.
+    Parsers rarely backtrack far so results for the positions left behind
+    the window are evicted.
+    '''
+    def __init__(self, window=1024):
+        '''
+        @param window - the size (in characters) of the window behind the 
+                        furthest position reached.
+        '''
+        self.window = window
+        self._results = {}      # position -> {expression id: (result, new position)}
+        self._positions = []    # heap of memoized positions
+        self._furthest = 0
+        self._size = 0
+
+    def get(self, expression, position):
+        results = self._results.get(position)
+        if results:
+            return results.get(id(expression))
+
+    def put(self, expression, position, result, new_position):
+        results = self._results.get(position)
+        if results is None:
+            results = self._results[position] = {}
+            heapq.heappush(self._positions, position)
+        if id(expression) not in results:
+            self._size += 1
+        results[id(expression)] = (result, new_position)
+
+        if new_position > self._furthest:
+            self._furthest = new_position
+            self._evict(new_position - self.window)
+
+    def _evict(self, limit):
+        '''
+        Evicts results for all positions before the limit.
+        '''
+        positions = self._positions
+        while positions and positions[0] < limit:
+            self._size -= len(self._results.pop(heapq.heappop(positions)))
+
+    def __len__(self):
+        return self._size
+
+
+class IncrementalMemo(Memo):
+    '''
+    Unbounded memoization table kept after the parse for Parser.reparse.
+    For each result it keeps the furthest position examined while parsing
+    the expression so that the results not affected by the edit of the input
+    can be reused.
+
+    Results are kept in chunks of the input. Positions of the results are 
+    relative to the start of their chunk and the lengths of the results are 
+    kept instead of their end positions, so an edit changes only the 
+    chunks it overlaps and the starts of the chunks after it. Results before
+    the edit which examined the edited text are dropped when they are read
+    (see _valid). Parse tree nodes of the results are _IncrementalNode 
+    instances which apply the edits when their positions are read.
+    '''
+    chunk_size = 4096
+
+    def __init__(self, parser):
+        self.parser = parser
+        self._length = len(parser.input)
+        self._starts = range(0, max(self._length, 1), self.chunk_size)
+        self._chunks = [{} for _ in self._starts]
+                            # (expression id, position in the chunk) -> 
+                            #   (result, length, examined length, 
+                            #    the number of edits checked)
+        self._edits = []    # (start, old length, new length, lookahead)
+        self._frames = []   # (key, examined position of the enclosing
+                            #  expression) for expressions being parsed
+        # The last chunk used and its start and end positions
+        self._chunk = None
+        self._chunk_start = self._chunk_end = 0
+
+    def _find(self, position):
+        '''
+        Makes the chunk of the given position the last used chunk.
+        '''
+        starts = self._starts
+        index = bisect.bisect_right(starts, position) - 1
+        self._chunk = self._chunks[index]
+        self._chunk_start = starts[index]
+        self._chunk_end = starts[index + 1] if index + 1 < len(starts) \
+                            else self._length + 1
+
+    def get(self, expression, position):
+        parser = self.parser
+        if not self._chunk_start <= position < self._chunk_end:
+            self._find(position)
+        chunk_key = (id(expression), position - self._chunk_start)
+        entry = self._chunk.get(chunk_key)
+        if entry is not None:
+            if entry[3] != len(self._edits):
+                if not self._valid(entry, position):
+                    del self._chunk[chunk_key]
+                    entry = None
+                else:
+                    entry = entry[:3] + (len(self._edits),)
+                    self._chunk[chunk_key] = entry
+        if entry is not None:
+            if position + entry[2] > parser._examined:
+                parser._examined = position + entry[2]
+            return entry[0], position + entry[1]
+        # Expression will be parsed. Track its examined position.
+        self._frames.append(((id(expression), position), parser._examined))
+        parser._examined = position
+
+    def _valid(self, entry, position):
+        '''
+        Checks that the text examined by the result at the given position 
+        is not changed by the edits made after the result was checked. 
+        Edits are undone from the last one.
+        '''
+        examined = entry[2]
+        for start, old_len, new_len, lookahead in \
+                reversed(self._edits[entry[3]:]):
+            if position >= start + new_len:
+                position -= new_len - old_len
+            elif position + examined + lookahead > start:
+                return False
+        return True
+
+    def put(self, expression, position, result, new_position):
+        parser = self.parser
+        key = (id(expression), position)
+        examined = max(parser._examined, new_position)
+        # Frames above the expression are left by the failed expressions.
+        while self._frames:
+            frame_key, outer = self._frames.pop()
+            if frame_key == key:
+                break
+            examined = max(examined, outer)
+        else:
+            outer = examined
+        # Reused results must not keep the input of this parse.
+        if isinstance(result, NonTerminal):
+            self._keep(result)
+            for node in result.nodes:
+                self._keep(node)
+        elif isinstance(result, Terminal):
+            self._keep(result)
+        if not self._chunk_start <= position < self._chunk_end:
+            self._find(position)
+        self._chunk[(id(expression), position - self._chunk_start)] = \
+            (result, new_position - position, examined - position, 
+             len(self._edits))
+        parser._examined = max(examined, outer)
+
+    def _keep(self, node):
+        '''
+        Makes the given parse tree node an _IncrementalNode independent of 
+        the input.
+        '''
+        node_class = type(node)
+        if node_class is LazyTerminal:
+            node._keep_value()
+            node_class = Terminal
+        incremental_class = _INCREMENTAL_CLASSES.get(node_class)
+        if incremental_class is not None:
+            state = (node.position, self._edits, len(self._edits))
+            node.__class__ = incremental_class
+            _position_slot.__set__(node, state)
+            if node.comments is not None:
+                self._keep(node.comments)
+                for comment in node.comments.nodes:
+                    self._keep(comment)
+
+    def edit(self, start, old_len, new_len, lookahead):
+        '''
+        Called when old_len characters at the start position are replaced
+        with new_len characters. Results in the chunks the edit overlaps 
+        which might be changed are dropped and the results after the edit 
+        are moved. The chunks are joined and split again if they get too 
+        large.
+        @param lookahead - the number of characters after the examined position
+                        a terminal might look at (e.g. length of the string 
+                        match or regex lookahead).
+        '''
+        end = start + old_len
+        delta = new_len - old_len
+        starts = self._starts
+        first = bisect.bisect_right(starts, start) - 1
+        last = bisect.bisect_right(starts, end) - 1
+        results = []
+        for index in xrange(first, last + 1):
+            chunk_start = starts[index]
+            for (expression_id, position), entry in \
+                    self._chunks[index].iteritems():
+                position += chunk_start
+                if position >= end:
+                    results.append((expression_id, position + delta, entry))
+                elif position + entry[2] + lookahead <= start:
+                    results.append((expression_id, position, entry))
+
+        self._length += delta
+        region_start = starts[first]
+        if last + 1 < len(starts):
+            region_end = starts[last + 1] + delta
+        else:
+            region_end = self._length + 1
+        if region_end - region_start > 2 * self.chunk_size:
+            new_starts = range(region_start, region_end, self.chunk_size)
+        else:
+            new_starts = [region_start]
+        new_chunks = [{} for _ in new_starts]
+        for expression_id, position, entry in results:
+            index = bisect.bisect_right(new_starts, position) - 1
+            new_chunks[index][(expression_id, position - new_starts[index])] \
+                = entry
+
+        starts[last + 1:] = [s + delta for s in starts[last + 1:]]
+        starts[first:last + 1] = new_starts
+        self._chunks[first:last + 1] = new_chunks
+        self._chunk = None
+        self._chunk_start = self._chunk_end = 0
+        self._edits.append((start, old_len, new_len, lookahead))
+        self._frames = []
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self._chunks)
+
+
 # ----------------------------------------------------
 # Parsers
 
+# Parser attributes copied from the parse context when the parse is finished.
+_PARSE_RESULTS = ('parse_tree', 'input', 'line_ends', 'position', 'nm', 
+                  '_stream', '_incremental_memo')
+
 class Parser(object):
-    def __init__(self, skipws=True, ws=DEFAULT_WS, reduce_tree=False):
+    def __init__(self, skipws=True, ws=DEFAULT_WS, reduce_tree=False, memo=Memo,
+                 memo_analysis=True, memo_rules=None, memo_policy=None,
+                 predict=True, optimize=True, left_factor=False, regular=True,
+                 tracer=None, iterative=False, incremental=False, flat=False):
         '''
         @skipws     - if True whitespaces will not be part of parse tree.
         @ws         - rule for matching ws
         @reduce_tree - if true nonterminals with single child will be eliminated.
+        @memo       - callable used to create memoization table for each parse
+                        (e.g. Memo, LRUMemo, WindowMemo).
+        @memo_analysis - if True only the expressions selected by the static
+                        analysis of the parser model will be memoized. 
+                        If False all expressions are memoized.
+        @memo_rules - dict used to override the memoization analysis. Keys are
+                        rule names and values are True/False.
+        @memo_policy - the name of the memoization policy file recorded
+                        by arpeggio.analysis.MemoProfile. Overrides the
+                        memoization analysis for the recorded expressions.
+        @predict    - if True ordered choices will try only alternatives
+                        that can start with the current character.
+        @optimize   - if True parser model will be rewritten to an equivalent
+                        model with fewer expressions (see arpeggio.optimize).
+        @left_factor - if True common prefixes of ordered choice alternatives
+                        will be matched only once. Parse trees are the same
+                        but NoMatch reports may differ.
+        @regular    - if True regular parts of the grammar will be matched
+                        by a single regular expression (see arpeggio.regular).
+                        Not used if comments are given or if parsing is 
+                        incremental.
+        @tracer     - arpeggio.tracing.Tracer instance notified about the 
+                        parsing progress.
+        @iterative  - if True parsing will use an explicit stack instead of
+                        python recursion (see arpeggio.iterative). Slower 
+                        but input nesting is not limited by the recursion 
+                        limit.
+        @incremental - if True memoization table is kept after the parse so 
+                        the input can be parsed again after the edit by the 
+                        reparse method. Memo parameter is not used and all
+                        rules are memoized.
+        @flat       - if True the parse tree will be kept in arrays and parse
+                        will return the view of its root node (see 
+                        arpeggio.flat). Uses less memory to keep large 
+                        trees. Peak memory use of parsing a string is not 
+                        reduced as the tree is moved to the arrays at the 
+                        end of the parse.
         '''
         self.skipws = skipws
         self.ws = ws
         self.reduce_tree = reduce_tree
+        self.memo_factory = memo
+        self.memo_analysis = memo_analysis
+        self.memo_rules = memo_rules
+        self.memo_policy = memo_policy
+        self.predict = predict
+        self.optimize = optimize
+        self.left_factor = left_factor
+        self.regular = regular
+        self.tracer = tracer
+        self.iterative = iterative
+        self.incremental = incremental
+        self.flat = flat
+        # Arguments the parser is created again with when unpickled.
+        self._init_args = ()
+        self._init_kwargs = dict(skipws=skipws, ws=ws, reduce_tree=reduce_tree,
+            memo=memo, memo_analysis=memo_analysis, memo_rules=memo_rules, 
+            memo_policy=memo_policy, predict=predict, optimize=optimize, 
+            left_factor=left_factor, regular=regular, tracer=tracer, 
+            iterative=iterative, incremental=incremental, flat=flat)
+        self.parser_model = None
         self.comments_model = None
         self.sem_actions = {}   
             
         self.parse_tree = None
+        self.memo = None
         self._in_parse_comment = False        
+        self._regular = False   # Use regular expressions of the model.
+        self._tracer = None     # Tracer used for the current parse.
+        self._stream = None     # StreamInput of the current parse.
+        self._examined = 0      # The furthest position examined by the 
+                                # expressions being parsed.
+        self._incremental_memo = None   # IncrementalMemo of the last parse.
+        self._ws_match = None   # match method of the whitespace regex.
+        self._set_input(None)
     
     def parse(self, _input):
+        '''
+        Parses the given input.
+        @param _input - string, file object or arpeggio.stream.StreamInput.
+                        File is read in chunks on demand (see arpeggio.stream).
+        '''
+        stream = None
+        if hasattr(_input, 'read'):
+            from arpeggio.stream import StreamInput, streamable
+            stream = _input
+            if not isinstance(stream, StreamInput):
+                stream = StreamInput(stream)
+            if streamable(self.parser_model):
+                _input = stream.buffer
+            else:
+                _input, stream = stream.read_all(), None
+        return self._parse_input(_input, stream)
+
+    def parse_many(self, inputs, workers=None, files=False, asg=False):
+        '''
+        Parses the inputs in worker processes (see arpeggio.pool).
+        @param inputs - iterable of the input strings or, if files is True, 
+                        of the names of the files to parse.
+        @param workers - the number of worker processes. If None the number
+                        of CPUs is used.
+        @param asg - if True the results are created by getASG. Otherwise
+                        the results are parse trees kept in arrays (see 
+                        arpeggio.flat).
+        @returns - list of (result, error) tuples in the order of the inputs.
+                    Error is None or the exception raised while parsing the
+                    input or creating its ASG. NoMatch sent 
+                    from the worker has no parser. Its line_col attribute
+                    is the (line, column) of the error.
+        Raises ArpeggioError if worker processes are used and the parser
+        can't be pickled (see arpeggio.pool).
+        '''
+        from arpeggio.pool import parse_many
+        return parse_many(self, inputs, workers, files, asg)
+
+    def parse_sliced(self, _input, steps=1000):
+        '''
+        Starts the parse which is done in slices so it can be interleaved 
+        with other work (see arpeggio.iterative.SlicedParse).
+        @param steps - the number of parser expressions parsed in a slice.
+        @returns - SlicedParse
+        '''
+        from arpeggio.iterative import SlicedParse
+        return SlicedParse(self, _input, steps)
+
+    def reparse(self, edit_start, old_len, new_text, lookahead=1024):
+        '''
+        Parses the input of the last parse changed by replacing old_len 
+        characters at edit_start with new_text. Memoized results of the last 
+        parse which are not affected by the edit are reused (see 
+        IncrementalMemo) so only the rules around the edit are parsed again.
+        Parser must be created with incremental=True.
+        Parse tree nodes after the edit are shared with the last parse tree
+        and their positions are shifted when they are read.
+        @param lookahead - see IncrementalMemo.edit
+        '''
+        if self._stream is not None:
+            raise ArpeggioError("Input read from a file can't be reparsed.")
+        _input = self.input[:edit_start] + new_text + \
+                    self.input[edit_start + old_len:]
+        memo = self._incremental_memo
+        if memo is None:
+            return self._parse_input(_input)
+        memo.edit(edit_start, old_len, len(new_text), lookahead)
+        return self._parse_input(_input, memo=memo)
+
+    def _parse_input(self, _input, stream=None, memo=None):
+        '''
+        Parses the input with the parse context. Context is the copy of the 
+        parser which keeps the state of a single parse (position, input, 
+        memoization table, NoMatch...) while the parser model is shared. The
+        model is not changed by parsing so the parser can parse in several 
+        threads at the same time. State of the finished parse is copied 
+        back to the parser for getASG, reparse and pos_to_linecol. If 
+        parses are finished at the same time the parser keeps the state of 
+        the one finished last, so the threads should give the parse tree
+        returned by parse to getASG.
+        @param stream - StreamInput the input is read from (see arpeggio.stream)
+        @param memo - IncrementalMemo with the results to reuse.
+        '''
+        context = copy.copy(self)
+        try:
+            return context._parse_context(_input, stream, memo)
+        finally:
+            self._publish(context)
+
+    def _publish(self, context):
+        '''
+        Copies the state of the finished parse from the parse context.
+        '''
+        for name in _PARSE_RESULTS:
+            setattr(self, name, getattr(context, name))
+
+    def __copy__(self):
+        # Parse context (see _parse_input). Not the same as pickling which 
+        # creates the parser again.
+        context = object.__new__(type(self))
+        context.__dict__.update(self.__dict__)
+        return context
+
+    def __reduce__(self):
+        '''
+        Parser is pickled as the arguments it was created with so the
+        unpickled parser builds its parser model again.
+        '''
+        return (_new_parser, (type(self), self._init_args, self._init_kwargs))
+
+    def _parse_context(self, _input, stream, memo):
+        '''
+        Called on the parse context (see _parse_input).
+        '''
+        for _ in self._parse_steps(_input, stream, memo):
+            pass
+        return self.parse_tree
+
+    def _parse_steps(self, _input, stream, memo, steps=None):
+        '''
+        Generator which parses the input on the parse context. 
+        @param steps - if given the parser model is parsed by the iterative
+                        engine which stops after each given number of parser
+                        expressions and the generator yields. Otherwise the
+                        generator doesn't yield.
+        '''
+        self._set_input(_input)
+        self._stream = stream
+        tracer = self.tracer
+        if tracer is None and logger.isEnabledFor(logging.DEBUG):
+            from arpeggio.tracing import DebugTracer
+            tracer = DebugTracer()
+        # Traced parse is done by the iterative engine which calls the
+        # tracer (see arpeggio.tracing).
+        self._tracer = tracer
+        try:
+            self._start(memo)
+            if stream is not None:
+                from arpeggio.stream import parse_stream
+                result = parse_stream(self, stream)
+            else:
+                for result in self._model_steps(steps):
+                    if result is SLICE:
+                        yield
+                if result is FAIL and (self._regular or memo is not None):
+                    # Regular expressions don't register NoMatch for the 
+                    # expressions inside them and reused results don't 
+                    # register it at all. Parse again without them to 
+                    # report the error.
+                    self._start()
+                    regular = self._regular
+                    self._regular = False
+                    try:
+                        for result in self._model_steps(steps):
+                            if result is SLICE:
+                                yield
+                    finally:
+                        self._regular = regular
+                if self.flat and isinstance(result, ParseTreeNode):
+                    from arpeggio.flat import FlatTree
+                    tree = FlatTree(_input)
+                    result = tree.node(tree.add(result))
+            if result is FAIL:
+                raise self.nm
+            self.parse_tree = result
+        finally:
+            # Memoized results are valid only for the current input.
+            self.memo = None
+            if stream is not None:
+                self._incremental_memo = None
+            self._tracer = None
+
+    def _model_steps(self, steps):
+        '''
+        Generator which yields SLICE after each given number of parser 
+        expressions (see IterativeEngine.parse_steps) and the result of the
+        parser model at the end. If steps is None the result is the only 
+        value.
+        '''
+        if steps is None:
+            yield self._parse()
+        else:
+            from arpeggio.iterative import IterativeEngine
+            for result in IterativeEngine(self).parse_steps(self.parser_model,
+                                                            steps):
+                yield result
+
+    def _parse(self):
+        if self.iterative or self._tracer is not None:
+            from arpeggio.iterative import IterativeEngine
+            return IterativeEngine(self).parse(self.parser_model)
+        return self.parser_model.parse(self)
+
+    def _start(self, memo=None):
+        '''
+        Resets the parser state at the beginning of the parse.
+        @param memo - memoization table to use instead of the new one.
+        '''
         self.position = 0 # Input position
-        self.nm_pos = 0 # Position for last NoMatch exception
         self.nm = None  # Last NoMatch exception
-        self.line_ends = []
-        self.input = _input
-        self.parse_tree = self._parse()
-        return self.parse_tree
+        self._examined = 0
+        self._ws_match = None
+        if self.skipws and self.ws:
+            self._ws_match = re.compile("[%s]*" % "".join(re.escape(c) 
+                                            for c in self.ws)).match
+        self.memo = self._new_memo(memo)
+
+    def _new_memo(self, memo=None):
+        '''
+        Creates memoization table for the current parse.
+        '''
+        if memo is None:
+            if self.incremental:
+                memo = self._incremental_memo = IncrementalMemo(self)
+            else:
+                memo = self.memo_factory()
+        elif isinstance(memo, IncrementalMemo):
+            # Memo of the last parse is used by the new parse context.
+            memo.parser = self
+        if self._tracer is not None:
+            from arpeggio.tracing import TracingMemo
+            memo = TracingMemo(memo, self, self._tracer)
+        return memo
+
+    def _init_model(self):
+        '''
+        Optimization and static analysis of the constructed parser model. 
+        Called by the concrete parsers after the parser model is built.
+        '''
+        from arpeggio.analysis import memo_analysis, load_memo_policy, \
+            first_analysis, model_nodes
+        from arpeggio.optimize import optimize, left_factor
+        if self.optimize:
+            self.parser_model = optimize(self.parser_model, self.reduce_tree)
+            if self.comments_model is not None:
+                self.comments_model = optimize(self.comments_model, 
+                                               self.reduce_tree)
+        if self.left_factor:
+            for model in (self.parser_model, self.comments_model):
+                if model is not None:
+                    left_factor(model)
+
+        overrides = {}
+        if self.memo_policy:
+            overrides.update(load_memo_policy(self.memo_policy))
+        if self.memo_rules:
+            overrides.update(self.memo_rules)
+        for model in (self.parser_model, self.comments_model):
+            if model is not None:
+                memo_analysis(model, overrides, self.memo_analysis)
+                if self.incremental:
+                    # Results of the rules are reused after the edit.
+                    for node in model_nodes(model):
+                        if node.root and not isinstance(node, Match):
+                            node.memoize = True
+        if self.predict:
+            first_analysis(self.parser_model, self.comments_model)
+        # Regular expression doesn't tell how far the input was examined
+        # so its results can't be invalidated by the edit (see reparse).
+        if self.regular and self.comments_model is None \
+                and not self.incremental:
+            from arpeggio.regular import regular_analysis
+            self._regular = regular_analysis(self.parser_model, self.skipws, 
+                                             self.ws) > 0
+    
+    def _model_options(self):
+        '''
+        @returns - hashable tuple of the options _init_model depends on. 
+                    Parser models built with the same options from the same
+                    grammar are the same.
+        '''
+        memo_policy = None
+        if self.memo_policy:
+            f = open(self.memo_policy)
+            try:
+                memo_policy = f.read()
+            finally:
+                f.close()
+        memo_rules = None
+        if self.memo_rules:
+            memo_rules = tuple(sorted(self.memo_rules.items()))
+        return (self.skipws, self.ws, self.reduce_tree, self.memo_analysis,
+                memo_rules, memo_policy, self.predict, self.optimize,
+                self.left_factor, self.regular, self.incremental)
     
-    def getASG(self, sem_actions=None):
+    def getASG(self, sem_actions=None, parse_tree=None):
         '''
         Creates Abstract Semantic Graph (ASG) from the parse tree.
         @param sem_actions - semantic actions dictionary to use for semantic analysis.
                             Rule names are the keys and semantic action objects are values.
+        @param parse_tree - the parse tree returned by parse. If not given the
+                            tree of the last finished parse is used. Must be 
+                            given if the parser is used by several threads 
+                            at the same time.
         '''
-        if not self.parse_tree:
+        if parse_tree is None:
+            parse_tree = self.parse_tree
+        if not parse_tree:
             raise Exception("Parse tree is empty. You did call parse(), didn't you?")
         
         if sem_actions is None:
@@ -608,7 +1544,7 @@ class Parser(object):
                 
                 
         logger.debug("ASG: First pass")
-        asg = tree_walk(self.parse_tree)
+        asg = tree_walk(parse_tree)
                 
         logger.debug("ASG: Second pass")
         # Second pass
@@ -621,6 +1557,8 @@ class Parser(object):
     def pos_to_linecol(self, pos):
         '''
         Calculate (line, column) tuple for the given position in the stream.
+        If the input was read from a file only the positions after the last
+        commit point can be calculated.
         '''
         if not self.line_ends:
             try:
@@ -633,53 +1571,176 @@ class Parser(object):
                         break
             except ValueError:
                 pass
-            
+
+        stream = self._stream
+        if stream is not None:
+            # Only the input after the last commit point is buffered.
+            pos -= stream.offset
         line = bisect.bisect_left(self.line_ends, pos)
         col = pos
         if line > 0:
             col -= self.line_ends[line-1]
             if self.input[self.line_ends[line-1]] in '\n\r':
                 col -= 1
+        elif stream is not None:
+            col += stream.col
+        if stream is not None:
+            line += stream.line
         return line+1, col+1
 
+    def _set_input(self, _input):
+        '''
+        Sets the text matched by the parser expressions.
+        '''
+        self.input = _input
+        self.line_ends = []
+        # position -> end of the whitespace run skipped from it
+        self._ws_ends = {}
+        self._ws_end = -1   # end of the last whitespace run skipped
+        # position -> (comments, position after them, examined position)
+        self._comments = {}
+
     def _skip_ws(self):
         '''
-        Skiping whitespace characters.
+        Skiping whitespace characters. Whitespace run is matched by the 
+        regular expression and remembered for its start position as the 
+        parser expressions skip it again when they start at the same 
+        position or backtrack to it.
         '''
-        if self.skipws:
-            while self.position<len(self.input) and self.input[self.position] in self.ws:
-                self.position += 1
+        position = self.position
+        end = self._ws_ends.get(position)
+        if end is None:
+            end = position
+            if self._ws_match is not None:
+                end = self._ws_match(self.input, position).end()
+            self._ws_ends[position] = end
+        self._ws_end = self.position = end
+
+    def _parse_comment(self):
+        '''
+        Parses a single comment at the current position.
+        '''
+        if self.iterative or self._tracer is not None:
+            from arpeggio.iterative import IterativeEngine
+            return IterativeEngine(self).parse(self.comments_model)
+        return self.comments_model.parse(self)
 
     def _skip_comments(self):
-        # We do not want to recurse into parsing comments
-        if comments_model and not self.in_skip_comments:
-            self.in_skip_comments = True
-            comments = self.comments_model.parse(self)
-            self.in_skip_comments = False
+        '''
+        Skipping comments before the terminal which didn't match. Comments
+        are parsed once for each position and remembered as all the 
+        terminals tried at the position on backtracking get the same 
+        comments.
+        @returns - NonTerminal with the comments or None.
+        '''
+        position = self.position
+        cached = self._comments.get(position)
+        if cached is not None:
+            comments, self.position, examined = cached
+            if examined > self._examined:
+                self._examined = examined
+            # Parsing comments would descend into the comments model
+            # (see first_analysis).
+            if self.nm is not None and \
+                    not isinstance(self.comments_model, Match):
+                self.nm._up = False
             return comments
 
-    def _nm_raise(self, *args):
+        outer = self._examined
+        self._examined = position
+        comments = []
+        try:
+            self._in_parse_comment = True
+            while True:
+                c_pos = self.position
+                comment = self._parse_comment()
+                if comment is FAIL:
+                    self.position = c_pos
+                    break
+                comments.append(comment)
+                self._skip_ws()
+        finally:
+            self._in_parse_comment = False
+        comments = NonTerminal('comment', position, comments) \
+            if comments else None
+        self._comments[position] = (comments, self.position, self._examined)
+        if outer > self._examined:
+            self._examined = outer
+        return comments
+
+    def _nm_fail(self, value, position):
         '''
         Register new NoMatch object if the input is consumed  
-        from the last NoMatch and raise last NoMatch
-        @param args - NoMatch instance or value, position, parser
+        from the last NoMatch.
+        @returns - FAIL to be returned by the failed parser expression.
         '''
+        if position > self._examined:
+            self._examined = position
         if not self._in_parse_comment:
-            if len(args)==1 and isinstance(args[0], NoMatch):
-                if self.nm is None or args[0].position > self.nm.position:
-                    self.nm = args[0]
-            else:
-                value, position, parser = args
-                if self.nm is None or position > self.nm.position:
-                    self.nm = NoMatch(value, position, parser)
-        raise self.nm
+            if self.nm is None or position > self.nm.position:
+                self.nm = NoMatch(value, position, self)
+        return FAIL
         
 
+def _new_parser(cls, args, kwargs):
+    '''
+    Creates the unpickled parser (see Parser.__reduce__).
+    '''
+    return cls(*args, **kwargs)
+
+
+# Parser models built by ParserPython. 
+# (language_def, comment_def, options) -> (parser_model, comments_model, 
+#                                          _regular, rule_functions)
+_python_models = {}
+
+
+def clear_models():
+    '''
+    Forgets the parser models shared by ParserPython parsers. Parsers
+    created afterwards build new models. Existing parsers keep their models.
+    '''
+    _python_models.clear()
+
+
 class ParserPython(Parser):
-    def __init__(self, language_def, comment_def=None, skipws=True, ws=DEFAULT_WS, \
-                 reduce_tree=False):
-        super(ParserPython, self).__init__(skipws, ws, reduce_tree)
+    def __init__(self, language_def, comment_def=None, *args, **kwargs):
+        '''
+        Parser model built from the rule functions is shared by all parsers
+        created for the same functions and options so rule functions are 
+        called only once in the process. Parsing doesn't change the model
+        and it must not be changed by the user. Shared models are kept
+        until clear_models is called.
+        @param language_def - the root rule function.
+        @param comment_def - the rule function matching comments.
+        Semantic actions are taken from the sem attributes of the rule
+        functions when each parser is created.
+        @param language_def - the root rule function.
+        @param comment_def - the rule function matching comments.
+        @param cache - keyword only. If False the parser model is built for
+                        this parser and not shared. Should be used if rule 
+                        functions return different grammars on each call
+                        or if the model is changed.
+        '''
+        cache = kwargs.pop('cache', True)
+        super(ParserPython, self).__init__(*args, **kwargs)
+        self._init_args = (language_def, comment_def)
+        self._init_kwargs['cache'] = cache
+
+        key = None
+        if cache and callable(language_def) and (comment_def is None or 
+                                                 callable(comment_def)):
+            key = (language_def, comment_def, self._model_options())
+            cached = _python_models.get(key)
+            if cached is not None:
+                self.parser_model, self.comments_model, self._regular, \
+                    rule_functions = cached
+                self._set_sem_actions(rule_functions)
+                return
                 
+        # (rule name, rule function) in the order the rules are built
+        self._rule_functions = []
+
         # PEG Abstract Syntax Graph
         self.parser_model = self._from_python(language_def)
         self.comments_model = self._from_python(comment_def) if comment_def else None
@@ -689,8 +1750,29 @@ class ParserPython(Parser):
             self.comments_model.root = True
             self.comments_model.rule = comment_def.__name__
 
-    def _parse(self):
-        return self.parser_model.parse(self)
+        self._init_model()
+
+        rule_functions = self._rule_functions
+        del self._rule_functions
+        if key is not None:
+            # The model built first is kept if parsers are created at the 
+            # same time from different threads.
+            self.parser_model, self.comments_model, self._regular, \
+                rule_functions = _python_models.setdefault(key, 
+                    (self.parser_model, self.comments_model, self._regular, 
+                     rule_functions))
+        self._set_sem_actions(rule_functions)
+
+    def _set_sem_actions(self, rule_functions):
+        '''
+        Sets the semantic actions of this parser from the current sem
+        attributes of the given rule functions.
+        @param rule_functions - list of (rule name, rule function).
+        '''
+        self.sem_actions = {}
+        for rule, function in rule_functions:
+            if hasattr(function, "sem"):
+                self.sem_actions[rule] = function.sem
 
     def _from_python(self, expression):
         """
@@ -722,9 +1804,8 @@ class ParserPython(Parser):
                     raise GrammarError(
                         "Rule element can't be just another rule in '%s'." % rule)            
     
-                # Semantic action for the rule
-                if hasattr(expression, "sem"):
-                    self.sem_actions[rule] = expression.sem
+                # Semantic action for the rule is set from the function
+                self._rule_functions.append((rule, expression))
                     
                 # Register rule cross-ref to support recursion
                 __rule_cache[rule] = CrossRef(rule)
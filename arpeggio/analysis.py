@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: analysis.py
+# Purpose: Static analysis of the parser model
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#######################################################################
+
+from arpeggio import Match, Memo, StrMatch, RegExMatch, EndOfFile, Sequence, \
+    OrderedChoice, Optional, ZeroOrMore, OneOrMore
+import string
+import sre_parse
+import sre_constants
+import logging
+
+logger = logging.getLogger('arpeggio.analysis')
+
+
+def model_nodes(model):
+    '''
+    Returns the list of all parser expressions reachable from the given
+    parser model node. Each expression is given only once.
+    '''
+    result = []
+    visited = set()
+    to_visit = [model]
+    while to_visit:
+        node = to_visit.pop()
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        result.append(node)
+        to_visit.extend(reversed(node.nodes))
+    return result
+
+
+def reference_counts(model):
+    '''
+    Returns dict id(expression) -> number of references to the expression
+    from other expressions of the parser model.
+    '''
+    refs = {}
+    for node in model_nodes(model):
+        for n in node.nodes:
+            refs[id(n)] = refs.get(id(n), 0) + 1
+    return refs
+
+
+def expression_keys(model):
+    '''
+    Returns dict id(expression) -> key where key is a string identifying the
+    expression in the parser model which is stable between parser instances
+    built from the same grammar. The key of the rule root expression is the
+    rule name. Other expressions are identified by the path of child indexes
+    from the enclosing rule, e.g. "jsonElements/1/0".
+    '''
+    keys = {}
+    used = set()
+    def visit(node, key):
+        if id(node) in keys:
+            return
+        if node.root and node.rule not in used:
+            key = node.rule
+        keys[id(node)] = key
+        used.add(key)
+        for i, n in enumerate(node.nodes):
+            visit(n, "%s/%d" % (key, i))
+    visit(model, model.rule if model.root else "")
+    return keys
+
+
+def memo_analysis(model, overrides=None, analysis=True):
+    '''
+    Decides which parser expressions of the given parser model will be
+    memoized by setting their memoize attribute.
+
+    Memoized result can be used only if the same expression is tried again at
+    the same position. Expressions referenced from only one place in the
+    parser model (e.g. anonymous sequences, optionals, repetitions and rules
+    used once) are reached only through their parent, so their results are
+    never looked up again once the parent is memoized. Thus, only shared
+    expressions (rules referenced from more than one place, e.g. from more
+    than one ordered choice branch) are memoized.
+
+    @param model - the root of the parser model.
+    @param overrides - dict expression key -> True/False used to force/prevent
+                        memoization of the given expressions. Keys are rule names 
+                        or other keys as given by expression_keys.
+    @param analysis - if False all expressions will be memoized (overrides
+                        still apply).
+    '''
+    refs = reference_counts(model)
+    if overrides:
+        keys = expression_keys(model)
+    memoized = 0
+    for node in model_nodes(model):
+        if isinstance(node, Match):
+            # Terminals are never memoized.
+            continue
+        if overrides and keys[id(node)] in overrides:
+            node.memoize = overrides[keys[id(node)]]
+        elif analysis:
+            node.memoize = refs.get(id(node), 0) > 1
+        else:
+            node.memoize = True
+        if node.memoize:
+            memoized += 1
+            logger.debug("Memoizing %s" % node.name)
+    logger.debug("Memoization analysis: %d expressions memoized." % memoized)
+
+
+# ---------------------------------------------------------
+# FIRST sets and ordered choice prediction
+#
+# FIRST set of the expression is given as a tuple (chars, nullable) where
+# chars is a frozenset of characters the expression match can start with 
+# or None if the set is not known (any character) and nullable is True if
+# the expression can succeed without consuming any character.
+# Only ASCII characters are used in FIRST sets.
+
+_ANY = (None, True)
+_EMPTY = (frozenset(), True)
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: string.digits,
+    sre_constants.CATEGORY_WORD: string.ascii_letters + string.digits + "_",
+    sre_constants.CATEGORY_SPACE: " \t\n\r\f\v",
+}
+
+# Regex flags which change the set of characters matched.
+_REGEX_FLAGS = sre_parse.SRE_FLAG_IGNORECASE | sre_parse.SRE_FLAG_LOCALE \
+                | sre_parse.SRE_FLAG_UNICODE
+
+
+def _char(code):
+    if code < 128:
+        return frozenset([chr(code)])
+
+
+def _seq_first(firsts):
+    '''
+    Combines FIRST sets of the sequence elements.
+    '''
+    chars = frozenset()
+    for c, nullable in firsts:
+        if c is None:
+            return _ANY
+        chars |= c
+        if not nullable:
+            return (chars, False)
+    return (chars, True)
+
+
+def _choice_first(firsts):
+    '''
+    Combines FIRST sets of the choice alternatives.
+    '''
+    chars = frozenset()
+    nullable = False
+    for c, n in firsts:
+        if c is None:
+            return _ANY
+        chars |= c
+        nullable = nullable or n
+    return (chars, nullable)
+
+
+def _regex_first(items):
+    '''
+    FIRST set of the regular expression given as parsed by sre_parse.
+    '''
+    def item_first(op, av):
+        if op == sre_constants.LITERAL:
+            c = _char(av)
+            return (c, False) if c else _ANY
+        elif op == sre_constants.IN:
+            chars = frozenset()
+            for iop, iav in av:
+                if iop == sre_constants.LITERAL:
+                    c = _char(iav)
+                elif iop == sre_constants.RANGE and iav[1] < 128:
+                    c = frozenset(chr(x) for x in range(iav[0], iav[1] + 1))
+                elif iop == sre_constants.CATEGORY and iav in _CATEGORIES:
+                    c = frozenset(_CATEGORIES[iav])
+                else:
+                    c = None
+                if c is None:
+                    return _ANY
+                chars |= c
+            return (chars, False)
+        elif op == sre_constants.SUBPATTERN:
+            return _regex_first(av[-1])
+        elif op == sre_constants.BRANCH:
+            return _choice_first([_regex_first(b) for b in av[1]])
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            min_repeat, max_repeat, item = av
+            chars, nullable = _regex_first(item)
+            return (chars, nullable or min_repeat == 0)
+        return _ANY
+    return _seq_first(item_first(op, av) for op, av in items)
+
+
+def first_sets(model):
+    '''
+    Calculates FIRST sets for all expressions of the given parser model.
+    @returns - dict id(expression) -> (chars, nullable)
+    '''
+    firsts = {}
+
+    def first(e):
+        if id(e) in firsts:
+            return firsts[id(e)]
+        # Guard against left recursion.
+        firsts[id(e)] = _ANY
+
+        if isinstance(e, StrMatch):
+            if not e.to_match:
+                result = _EMPTY
+            else:
+                c = _char(ord(e.to_match[0]))
+                result = (c, False) if c else _ANY
+        elif isinstance(e, RegExMatch):
+            if e.regex.flags & _REGEX_FLAGS:
+                result = _ANY
+            else:
+                try:
+                    result = _regex_first(sre_parse.parse(e.to_match, e.regex.flags))
+                except Exception:
+                    result = _ANY
+        elif isinstance(e, EndOfFile):
+            # Succeeds only at the end of input.
+            result = (frozenset(), False)
+        elif isinstance(e, OrderedChoice):
+            result = _choice_first([first(n) for n in e.nodes])
+        elif isinstance(e, Sequence):
+            result = _seq_first(first(n) for n in e.nodes)
+        elif isinstance(e, (Optional, ZeroOrMore)):
+            result = (first(e.nodes[0])[0], True)
+        elif isinstance(e, OneOrMore):
+            result = first(e.nodes[0])
+        else:
+            # Syntax predicates may fail after consuming input and unknown
+            # expressions can do anything.
+            result = _ANY
+
+        firsts[id(e)] = result
+        return result
+
+    for node in model_nodes(model):
+        first(node)
+    return firsts
+
+
+def first_analysis(model, comments_model=None):
+    '''
+    Builds prediction tables for ordered choices of the given parser model.
+
+    Ordered choice will skip alternatives which can't start with the current 
+    input character. Characters which can start a comment are not used for 
+    prediction as comments are matched only after the terminal fails. If the
+    FIRST set of comments is not known prediction is not used.
+
+    @param model - the root of the parser model.
+    @param comments_model - comments parser model used with the model.
+    '''
+    comment_chars = frozenset()
+    if comments_model is not None:
+        comment_chars, nullable = first_sets(comments_model)[id(comments_model)]
+        if comment_chars is None or nullable:
+            logger.debug("Comments FIRST set unknown. Prediction disabled.")
+            return
+        # Comments model choices are used without comments.
+        first_analysis(comments_model)
+
+    firsts = first_sets(model)
+    for node in model_nodes(model):
+        if not isinstance(node, OrderedChoice):
+            continue
+        alternatives = [firsts[id(n)] for n in node.nodes]
+        default = tuple(chars is None or nullable 
+                        for chars, nullable in alternatives)
+        if all(default):
+            # Nothing to predict.
+            continue
+        table = {}
+        for chars, nullable in alternatives:
+            if chars:
+                for c in chars:
+                    table[c] = tuple(d or c in a[0] for d, a in 
+                                     zip(default, alternatives))
+        for c in comment_chars:
+            table[c] = tuple(True for n in node.nodes)
+        node.first_table = table
+        node.first_default = default
+        # Failed terminal tries comments which sets NoMatch._up to False.
+        node.skip_down = tuple(not isinstance(n, Match) or
+                               (comments_model is not None and 
+                                not isinstance(comments_model, Match))
+                               for n in node.nodes)
+
+
+# ---------------------------------------------------------
+# Profile-guided memoization
+#
+# Parser is used in the record mode over a representative set of inputs
+# with all expressions memoized and memoization hits/misses are collected 
+# per expression:
+#
+#   profile = MemoProfile()
+#   parser = ParserPython(jsonFile, memo=profile, memo_analysis=False)
+#   for _input in inputs:
+#       parser.parse(_input)
+#   profile.save("json.memo", parser)
+#
+# Saved policy file is used for parser construction:
+#
+#   parser = ParserPython(jsonFile, memo_policy="json.memo")
+#
+# and only expressions which had memoization hits will be memoized.
+
+class ProfilingMemo(Memo):
+    '''
+    Unbounded memoization table which records lookups in the given profile.
+    '''
+    def __init__(self, profile):
+        super(ProfilingMemo, self).__init__()
+        self.profile = profile
+
+    def get(self, expression, position):
+        result = super(ProfilingMemo, self).get(expression, position)
+        self.profile.record(expression, result is not None)
+        return result
+
+
+class MemoProfile(object):
+    '''
+    Collects memoization hits and misses per parser expression over many
+    parses. Instance is used as a memo factory of the parser.
+    '''
+    def __init__(self):
+        self.stats = {}     # id(expression) -> [expression, hits, misses]
+
+    def __call__(self):
+        return ProfilingMemo(self)
+
+    def record(self, expression, hit):
+        stat = self.stats.get(id(expression))
+        if stat is None:
+            stat = self.stats[id(expression)] = [expression, 0, 0]
+        if hit:
+            stat[1] += 1
+        else:
+            stat[2] += 1
+
+    def save(self, file_name, parser):
+        '''
+        Saves collected statistics to the memoization policy file.
+        @param parser - the parser used for recording.
+        '''
+        f = open(file_name, "w")
+        try:
+            f.write("# Arpeggio memoization profile\n")
+            f.write("# expression hits misses\n")
+            for model in (parser.parser_model, parser.comments_model):
+                if model is None:
+                    continue
+                keys = expression_keys(model)
+                for node in model_nodes(model):
+                    stat = self.stats.get(id(node))
+                    if stat is not None:
+                        f.write("%s %d %d\n" % (keys[id(node)], stat[1], stat[2]))
+        finally:
+            f.close()
+
+
+def load_memo_policy(file_name, min_hits=1):
+    '''
+    Loads memoization policy file saved by MemoProfile.
+    @param min_hits - minimal number of recorded hits for the expression to
+                        be memoized.
+    @returns - dict expression key -> True/False usable as memoization overrides.
+    '''
+    policy = {}
+    f = open(file_name)
+    try:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            key, hits, misses = line.rsplit(None, 2)
+            policy[key] = int(hits) >= min_hits
+    finally:
+        f.close()
+    return policy
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: codegen.py
+# Purpose: Compiling parser model to python source
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#
+# Parser model (constructed by ParserPython or ParserPEG) is translated to
+# a standalone python module with one function per grammar rule. Anonymous
+# parser expressions and terminal matches are inlined in the rule functions
+# so parsing doesn't need to interpret the parser model.
+# Generated module produces the same parse trees as the parser it is
+# generated from, e.g.:
+#
+#   parser = ParserPython(jsonFile)
+#   generate_file(parser, "json_parser.py")
+#   ...
+#   from json_parser import GeneratedParser
+#   parse_tree = GeneratedParser().parse(json_input)
+#
+# Semantic actions are not a part of the parser model so they are not
+# compiled. Pass them to getASG of the generated parser.
+#######################################################################
+
+__all__ = ['CompiledParser', 'generate', 'generate_file']
+
+import re
+from arpeggio import Parser, Match, StrMatch, RegExMatch, EndOfFile, \
+    Sequence, OrderedChoice, Optional, ZeroOrMore, OneOrMore, And, Not, \
+    FAIL, ArpeggioError
+from arpeggio.analysis import model_nodes, reference_counts
+import logging
+
+logger = logging.getLogger('arpeggio.codegen')
+
+# Python limits the number of statically nested blocks (loops and try
+# statements) in a function. Deeper expressions are generated as separate
+# functions.
+MAX_BLOCK_DEPTH = 12
+
+
+def _comment(text):
+    return "# %s" % text.replace("\r", "\\r").replace("\n", "\\n")
+
+
+class CompiledParser(Parser):
+    '''
+    Base class for the parsers generated by this module.
+    '''
+    # Generated function used to parse the model root.
+    _parse_model = None
+    # Generated function used to parse comments or None.
+    _parse_comment = None
+
+    def _parse(self):
+        return self._parse_model()
+
+    def _match_failed(self, match):
+        '''
+        Called from the generated code when the terminal didn't match at the
+        current position. Registers NoMatch and tries to match comments before
+        the terminal the same way Match.parse does.
+        @param match - generated function which matches the terminal at the
+                        current position.
+        '''
+        if self._in_parse_comment or self._parse_comment is None:
+            return match(self)
+        result = match(self)
+        if result is FAIL:
+            # If not matched skip comments and try terminal match again
+            comments = self._skip_comments()
+            if comments is not None:
+                # Failure after the comments is not registered as NoMatch.
+                self._in_parse_comment = True
+                try:
+                    result = match(self)
+                finally:
+                    self._in_parse_comment = False
+                if result is not FAIL:
+                    result = result.with_comments(comments)
+        return result
+
+
+class _Function(object):
+    '''
+    Source code of a single generated function.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.lines = []
+        self._var_count = 0
+
+    def var(self, prefix):
+        self._var_count += 1
+        return "%s%d" % (prefix, self._var_count)
+
+    def emit(self, indent, line):
+        self.lines.append("%s%s" % ("    " * indent, line))
+
+
+class CodeGenerator(object):
+    '''
+    Translates parser model of the given parser to python source.
+    '''
+    def __init__(self, parser):
+        self.parser = parser
+        self.functions = {}     # id(expression) -> function name
+        self.matches = {}       # id(match expression) -> match function name
+        self.names = set()
+        self.regexes = []       # (name, regex)
+        self.regex_names = {}   # id(match expression) -> regex name
+        self.tables = []        # (name, value) for prediction tables
+        self.to_generate = []   # expressions whose functions are not generated yet
+        self.code = []          # generated functions
+
+        self.refs = {}
+        for model in self._models():
+            for key, count in reference_counts(model).items():
+                self.refs[key] = self.refs.get(key, 0) + count
+
+    def _models(self):
+        return [m for m in (self.parser.parser_model, self.parser.comments_model)
+                if m is not None]
+
+    def _unique_name(self, name):
+        name = re.sub(r'\W', '_', name)
+        unique_name = name
+        i = 1
+        while unique_name in self.names:
+            i += 1
+            unique_name = "%s_%d" % (name, i)
+        self.names.add(unique_name)
+        return unique_name
+
+    def _own_function(self, expression):
+        '''
+        Should the given expression be generated as a separate function?
+        '''
+        return expression.root or expression.memoize \
+                or self.refs.get(id(expression), 0) > 1
+
+    def _function_name(self, expression):
+        '''
+        Returns the name of the function for the given expression and
+        schedules its generation.
+        '''
+        name = self.functions.get(id(expression))
+        if name is None:
+            if expression.root:
+                name = self._unique_name("_rule_%s" % expression.rule)
+            else:
+                name = self._unique_name("_%s" %
+                                         expression.__class__.__name__.lower())
+            self.functions[id(expression)] = name
+            self.to_generate.append(expression)
+        return name
+
+    def generate(self):
+        model_func = self._function_name(self.parser.parser_model)
+        comment_func = None
+        if self.parser.comments_model is not None:
+            comment_func = self._function_name(self.parser.comments_model)
+
+        while self.to_generate:
+            self._gen_function(self.to_generate.pop(0))
+
+        src = []
+        src.append("# -*- coding: utf-8 -*-")
+        src.append("# Generated by arpeggio.codegen. Do not edit.")
+        src.append("")
+        src.append("import re")
+        src.append("from arpeggio import Terminal, LazyTerminal, NonTerminal, FAIL, flatten")
+        src.append("from arpeggio.codegen import CompiledParser")
+        src.append("")
+        for name, regex in self.regexes:
+            src.append("%s = re.compile(%r, %d)" % (name, regex.pattern, regex.flags))
+        for name, value in self.tables:
+            src.append("%s = %r" % (name, value))
+        src.append("")
+        src.extend(self.code)
+        src.append("")
+        src.append("class GeneratedParser(CompiledParser):")
+        src.append("    def __init__(self, skipws=%r, ws=%r, reduce_tree=%r, *args, **kwargs):"
+                   % (self.parser.skipws, self.parser.ws, self.parser.reduce_tree))
+        src.append("        super(GeneratedParser, self).__init__(skipws, ws, reduce_tree, "
+                   "*args, **kwargs)")
+        src.append("")
+        src.append("    def _parse_model(self):")
+        src.append("        return %s(self)" % model_func)
+        if comment_func:
+            src.append("")
+            src.append("    def _parse_comment(self):")
+            src.append("        return %s(self)" % comment_func)
+        src.append("")
+        return "\n".join(src)
+
+    def _gen_function(self, expression):
+        '''
+        Generates function which is equivalent to expression.parse.
+        '''
+        f = _Function(self.functions[id(expression)])
+        f.emit(0, "def %s(p):" % f.name)
+        if isinstance(expression, Match):
+            f.emit(1, "return %s" % self._gen_match(f, expression, 1))
+            f.emit(0, "")
+            self.code.extend(f.lines)
+            return
+        f.emit(1, _comment(expression.name))
+        self._gen_skip_ws(f, 1)
+        f.emit(1, "c = p.position")
+        if expression.memoize:
+            f.emit(1, "cached = p.memo.get(%s, c)" % f.name)
+            f.emit(1, "if cached is not None:")
+            f.emit(2, "p.position = cached[1]")
+            f.emit(2, "return cached[0]")
+        f.emit(1, "if p.nm:")
+        f.emit(2, "p.nm._up = False")
+        result = self._gen_body(f, expression, "c", 1, 0)
+        f.emit(1, "if %s is FAIL:" % result)
+        if expression.alias is not None:
+            f.emit(2, "if p.nm is not None and p.nm.position == c and "
+                   "p.nm._up:")
+            f.emit(3, "p.nm.value = %r" % expression.alias)
+        f.emit(2, "return %s" % result)
+
+        if expression.root:
+            f.emit(1, "if %s:" % result)
+            f.emit(2, "if p.reduce_tree:")
+            f.emit(3, "if isinstance(%s, list):" % result)
+            f.emit(4, "%s = flatten(%s)" % (result, result))
+            f.emit(4, "if len(%s) > 1:" % result)
+            f.emit(5, "%s = NonTerminal(%r, c, %s)" % (result, expression.rule, result))
+            f.emit(4, "else:")
+            f.emit(5, "%s = %s[0]" % (result, result))
+            f.emit(2, "else:")
+            f.emit(3, "%s = NonTerminal(%r, c, %s)" % (result, expression.rule, result))
+        if expression.memoize:
+            f.emit(1, "p.memo.put(%s, c, %s, p.position)" % (f.name, result))
+        f.emit(1, "return %s" % result)
+        f.emit(0, "")
+        self.code.extend(f.lines)
+
+    def _gen_expression(self, f, expression, indent, depth):
+        '''
+        Generates code equivalent to expression.parse at the given place.
+        @returns - the name of the variable holding the result.
+        '''
+        if isinstance(expression, Match):
+            return self._gen_match(f, expression, indent)
+
+        result = f.var("r")
+        if self._own_function(expression) or depth >= MAX_BLOCK_DEPTH:
+            f.emit(indent, "%s = %s(p)" % (result, self._function_name(expression)))
+            return result
+
+        c_pos = f.var("c")
+        f.emit(indent, _comment(expression.name))
+        self._gen_skip_ws(f, indent)
+        f.emit(indent, "%s = p.position" % c_pos)
+        f.emit(indent, "if p.nm:")
+        f.emit(indent + 1, "p.nm._up = False")
+        return self._gen_body(f, expression, c_pos, indent, depth)
+
+    def _gen_body(self, f, expression, c_pos, indent, depth):
+        '''
+        Generates code equivalent to expression._parse.
+        @returns - the name of the variable holding the result.
+        '''
+        result = f.var("r")
+
+        if isinstance(expression, OrderedChoice):
+            f.emit(indent, "%s = FAIL" % result)
+            predict = None
+            if expression.first_table is not None:
+                predict = f.var("pr")
+                table = self._unique_name("_first")
+                default = self._unique_name("_first_default")
+                self.tables.append((table, expression.first_table))
+                self.tables.append((default, expression.first_default))
+                f.emit(indent, "%s = None" % predict)
+                f.emit(indent, "if %s < len(p.input):" % c_pos)
+                f.emit(indent + 1, "%s = %s.get(p.input[%s], %s)"
+                       % (predict, table, c_pos, default))
+            for i, e in enumerate(expression.nodes):
+                ind = indent
+                if i > 0:
+                    f.emit(indent, "if %s is FAIL:" % result)
+                    ind += 1
+                if predict is not None and not expression.first_default[i]:
+                    # See OrderedChoice._parse
+                    f.emit(ind, "if %s is not None and not %s[%d] and p.nm is not None "
+                           "and p.nm.position >= %s:" % (predict, predict, i, c_pos))
+                    if expression.skip_down[i]:
+                        f.emit(ind + 1, "p.nm._up = False")
+                    elif expression.root:
+                        self._gen_nm_change_rule(f, expression, c_pos, ind + 1)
+                    else:
+                        f.emit(ind + 1, "pass")
+                    f.emit(ind, "else:")
+                    ind += 1
+                r = self._gen_expression(f, e, ind, depth + 1)
+                f.emit(ind, "if %s is FAIL:" % r)
+                f.emit(ind + 1, "p.position = %s" % c_pos)
+                self._gen_nm_change_rule(f, expression, c_pos, ind + 1)
+                f.emit(ind, "else:")
+                f.emit(ind + 1, "%s = %s" % (result, r))
+
+        elif isinstance(expression, Sequence):
+            # Single pass loop is used to stop at the first failure.
+            f.emit(indent, "%s = []" % result)
+            f.emit(indent, "while True:")
+            for e in expression.nodes:
+                r = self._gen_expression(f, e, indent + 1, depth + 1)
+                f.emit(indent + 1, "if %s is FAIL:" % r)
+                self._gen_nm_change_rule(f, expression, c_pos, indent + 2)
+                f.emit(indent + 2, "%s = FAIL" % result)
+                f.emit(indent + 2, "break")
+                f.emit(indent + 1, "if %s:" % r)
+                f.emit(indent + 2, "%s.append(%s)" % (result, r))
+            f.emit(indent + 1, "break")
+
+        elif isinstance(expression, Optional):
+            r = self._gen_expression(f, expression.nodes[0], indent, depth + 1)
+            f.emit(indent, "%s = %s" % (result, r))
+            f.emit(indent, "if %s is FAIL:" % result)
+            f.emit(indent + 1, "p.position = %s" % c_pos)
+            f.emit(indent + 1, "%s = None" % result)
+
+        elif isinstance(expression, (ZeroOrMore, OneOrMore)):
+            it_pos = f.var("c")
+            f.emit(indent, "%s = []" % result)
+            f.emit(indent, "while True:")
+            f.emit(indent + 1, "%s = p.position" % it_pos)
+            r = self._gen_expression(f, expression.nodes[0], indent + 1, depth + 1)
+            f.emit(indent + 1, "if %s is FAIL:" % r)
+            f.emit(indent + 2, "p.position = %s" % it_pos)
+            if isinstance(expression, OneOrMore):
+                f.emit(indent + 2, "if not %s:" % result)
+                f.emit(indent + 3, "%s = FAIL" % result)
+            f.emit(indent + 2, "break")
+            f.emit(indent + 1, "%s.append(%s)" % (result, r))
+
+        elif isinstance(expression, (And, Not)):
+            # Single pass loop is used to stop at the first failure.
+            f.emit(indent, "%s = None" % result)
+            f.emit(indent, "while True:")
+            for e in expression.nodes:
+                r = self._gen_expression(f, e, indent + 1, depth + 1)
+                f.emit(indent + 1, "if %s is FAIL:" % r)
+                f.emit(indent + 2, "%s = FAIL" % result)
+                f.emit(indent + 2, "break")
+            f.emit(indent + 1, "break")
+            f.emit(indent, "if %s is not FAIL and p.position > p._examined:" % result)
+            f.emit(indent + 1, "p._examined = p.position")
+            f.emit(indent, "p.position = %s" % c_pos)
+            if isinstance(expression, Not):
+                f.emit(indent, "if %s is FAIL:" % result)
+                f.emit(indent + 1, "%s = None" % result)
+                f.emit(indent, "else:")
+                f.emit(indent + 1, "%s = p._nm_fail(%r, %s)" % (result, expression.name, c_pos))
+
+        else:
+            raise ArpeggioError("Can't generate code for %s." % expression.name)
+
+        return result
+
+    def _gen_nm_change_rule(self, f, expression, c_pos, indent, nm="p.nm"):
+        '''
+        Generates code equivalent to expression._nm_change_rule.
+        '''
+        if expression.root:
+            f.emit(indent, "if %s.position == %s and %s._up:" % (nm, c_pos, nm))
+            f.emit(indent + 1, "%s.value = %r" % (nm, expression.rule))
+
+    def _gen_match(self, f, match, indent):
+        '''
+        Generates inlined terminal match equivalent to Match.parse.
+        '''
+        result = f.var("r")
+        c_pos = f.var("c")
+        match_func = self._match_function(match)
+        self._gen_skip_ws(f, indent)
+        f.emit(indent, "%s = p.position" % c_pos)
+        statements, value = self._gen_match_test(f, match, c_pos, indent)
+        for line in statements:
+            f.emit(indent + 1, line)
+        f.emit(indent + 1, "%s = %s" % (result, value))
+        f.emit(indent, "else:")
+        f.emit(indent + 1, "%s = p._match_failed(%s)" % (result, match_func))
+        return result
+
+    def _gen_skip_ws(self, f, indent):
+        '''
+        Generates code equivalent to ParsingExpression._parse_intro.
+        '''
+        f.emit(indent, "if p.position != p._ws_end:")
+        f.emit(indent + 1, "p._skip_ws()")
+
+    def _gen_match_test(self, f, match, c_pos, indent):
+        '''
+        Emits the test for the terminal match at c_pos.
+        @returns - (statements, value) where statements are executed on 
+                    successful match and value is the resulting terminal 
+                    expression.
+        '''
+        term_type = match.rule if match.root else ''
+        if isinstance(match, StrMatch):
+            f.emit(indent, "if p.input.startswith(%r, %s):" % (match.to_match, c_pos))
+            return (["p.position = %s + %d" % (c_pos, len(match.to_match))],
+                    "Terminal(%r, %s, %r, False, p.position)" % 
+                    (term_type, c_pos, match.to_match))
+        elif isinstance(match, RegExMatch):
+            regex = self._regex_name(match)
+            m = f.var("m")
+            f.emit(indent, "%s = %s.match(p.input, %s)" % (m, regex, c_pos))
+            f.emit(indent, "if %s:" % m)
+            return (["p.position = %s.end()" % m],
+                    "LazyTerminal(%r, %s, p.position, p.input)" % 
+                    (term_type, c_pos))
+        elif isinstance(match, EndOfFile):
+            f.emit(indent, "if %s == len(p.input):" % c_pos)
+            return ([], "Terminal(%r, %s, 'EOF', False, %s)" % 
+                    (term_type, c_pos, c_pos))
+        else:
+            raise ArpeggioError("Can't generate code for %s." % match.name)
+
+    def _match_function(self, match):
+        '''
+        Returns the name of the function equivalent to match._parse.
+        '''
+        name = self.matches.get(id(match))
+        if name is None:
+            name = self.matches[id(match)] = self._unique_name("_match")
+            if isinstance(match, RegExMatch):
+                nm_value = match.root if match.root else match.name
+            elif isinstance(match, StrMatch):
+                nm_value = match.to_match
+            else:
+                nm_value = match.name
+            f = _Function(name)
+            f.emit(0, "def %s(p):" % name)
+            f.emit(1, _comment(match.name))
+            f.emit(1, "c = p.position")
+            statements, value = self._gen_match_test(f, match, "c", 1)
+            for line in statements:
+                f.emit(2, line)
+            f.emit(2, "return %s" % value)
+            f.emit(1, "return p._nm_fail(%r, c)" % (nm_value,))
+            f.emit(0, "")
+            self.code.extend(f.lines)
+        return name
+
+    def _regex_name(self, match):
+        name = self.regex_names.get(id(match))
+        if name is None:
+            name = self.regex_names[id(match)] = self._unique_name("_regex")
+            self.regexes.append((name, match.regex))
+        return name
+
+
+def generate(parser):
+    '''
+    Generates python module source for the parser model of the given parser.
+    Generated module defines GeneratedParser class.
+    @param parser - ParserPython or ParserPEG instance.
+    '''
+    return CodeGenerator(parser).generate()
+
+
+def generate_file(parser, file_name):
+    '''
+    Generates python module for the parser model of the given parser and
+    writes it to the given file.
+    '''
+    f = open(file_name, "w")
+    try:
+        f.write(generate(parser))
+    finally:
+        f.close()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: flat.py
+# Purpose: Parse tree kept in arrays
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#
+# Parser created with flat=True keeps the parse tree in a FlatTree instead
+# of one python object per node:
+#
+#   parser = ParserPython(jsonFile, flat=True)
+#   parse_tree = parser.parse(json_input)
+#   tree = parse_tree.tree
+#
+# Nodes are rows of parallel arrays (rule id, start, end, parent, first
+# child, next sibling, flags) and terminal values are slices of the input.
+# Parse returns the view of the root node. Views (FlatTerminal and
+# FlatNonTerminal) are created on demand and have the attributes of
+# Terminal and NonTerminal so getASG and the exporters work with them.
+# FlatTree is pickled as a few strings so it is cheap to send to another
+# process.
+#
+# Parser expressions still create parse tree nodes because memoized
+# results are shared between the alternatives. The tree is moved to the
+# arrays when it can't change any more: at the end of the parse or, when
+# the input is read from a file (see arpeggio.stream), after each commit
+# point, so only the nodes of the current item exist as objects.
+# Thus, when a string is parsed the whole tree of objects exists at the 
+# end of the parse and the peak memory use is not lower than without
+# flat. Memory is saved after the parse, while the tree is kept, and when 
+# parsing files.
+#######################################################################
+
+from array import array
+from arpeggio import Terminal, NonTerminal
+
+# Node flags
+TERMINAL = 1
+ERROR = 2
+
+
+class FlatTree(object):
+    '''
+    Parse tree kept in parallel arrays indexed by the node index.
+    Nodes are added in the depth-first order with all children of the node
+    added at once.
+    '''
+    def __init__(self, input=None):
+        '''
+        @param input - parsed input. Values of the terminals are its slices.
+        '''
+        self.input = input
+        self.names = []             # rule names indexed by the rule id
+        self.rule = array('i')
+        self.start = array('l')
+        self.end = array('l')
+        self.parent = array('i')        # -1 for the root
+        self.first_child = array('i')   # -1 for terminals
+        self.next_sibling = array('i')  # -1 for the last child
+        self.flags = array('b')
+        self.values = {}    # index -> terminal value which is not a slice
+                            # of the input (e.g. EOF)
+        self.comments = {}  # index -> index of the comments of the terminal
+        self.root = -1      # index of the root node of the last added tree
+        self._rule_ids = {}
+
+    def __len__(self):
+        return len(self.start)
+
+    def node(self, index):
+        '''
+        @returns - the view of the node with the given index.
+        '''
+        if self.flags[index] & TERMINAL:
+            return FlatTerminal(self, index)
+        return FlatNonTerminal(self, index)
+
+    def children(self, index):
+        '''
+        @returns - indexes of the children of the given node.
+        '''
+        result = []
+        child = self.first_child[index]
+        while child != -1:
+            result.append(child)
+            child = self.next_sibling[child]
+        return result
+
+    def add(self, node):
+        '''
+        Adds the parse tree with the given root node.
+        Views of the nodes of this tree found in the given tree are linked
+        and not copied so each of them can be added only once.
+        @returns - the index of the root node.
+        '''
+        self.root = self._add(node, self.input, 0)
+        return self.root
+
+    def _add(self, node, input, offset):
+        '''
+        @param input - input text starting at the offset position. Must
+                        contain the text of the terminals.
+        '''
+        rule_ids = self._rule_ids
+        parent = self.parent
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+        end = self.end
+        flags = self.flags
+        base = len(flags)
+        to_visit = []
+        append_rule = self.rule.append
+        append_start = self.start.append
+        append_end = end.append
+        append_parent = parent.append
+        append_first_child = first_child.append
+        append_next_sibling = next_sibling.append
+        append_flags = flags.append
+
+        def append(node, parent_index):
+            '''
+            Appends the given node without its children.
+            @returns - the index of the node.
+            '''
+            if isinstance(node, FlatNode) and node.tree is self:
+                parent[node.index] = parent_index
+                return node.index
+            index = len(flags)
+            position = node.position
+            if isinstance(node, NonTerminal):
+                node_end = position
+                node_flags = 0
+                if node.nodes or node.comments is not None:
+                    to_visit.append((node, index))
+            else:
+                node_end = node.end
+                if node._input is not input or offset:
+                    value = node.value
+                    if input[position - offset:node_end - offset] != value:
+                        self.values[index] = value
+                node_flags = TERMINAL
+                if node.comments is not None:
+                    to_visit.append((node, index))
+            if node.error:
+                node_flags |= ERROR
+            rule = rule_ids.get(node.type)
+            if rule is None:
+                rule = rule_ids[node.type] = len(self.names)
+                self.names.append(node.type)
+            append_rule(rule)
+            append_start(position)
+            append_end(node_end)
+            append_parent(parent_index)
+            append_first_child(-1)
+            append_next_sibling(-1)
+            append_flags(node_flags)
+            return index
+
+        root = append(node, -1)
+        while to_visit:
+            node, index = to_visit.pop()
+            if node.comments is not None:
+                self.comments[index] = append(node.comments, index)
+            if isinstance(node, NonTerminal):
+                previous = -1
+                for child in node.nodes:
+                    child = append(child, index)
+                    if previous == -1:
+                        first_child[index] = child
+                    else:
+                        next_sibling[previous] = child
+                    previous = child
+                if previous != -1 and previous < base:
+                    # Linked node of this tree is the last child.
+                    end[index] = end[previous]
+
+        # Parents are added before their children so the ends of the
+        # non-terminals are set from the last children going backwards.
+        for index in xrange(len(flags) - 1, base, -1):
+            if next_sibling[index] == -1:
+                parent_index = parent[index]
+                if not flags[parent_index] & TERMINAL:
+                    end[parent_index] = end[index]
+        return root
+
+    def __getstate__(self):
+        # Arrays are pickled as lists of ints so they are given as strings.
+        state = self.__dict__.copy()
+        del state['_rule_ids']
+        for name, typecode in _ARRAYS:
+            state[name] = state[name].tostring()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name, typecode in _ARRAYS:
+            a = array(typecode)
+            a.fromstring(state[name])
+            setattr(self, name, a)
+        self._rule_ids = dict((name, rule) for rule, name
+                              in enumerate(self.names))
+
+
+# Arrays of the FlatTree and their type codes. Positions are longs as the
+# input read from a file may be longer than 2**31 characters.
+_ARRAYS = (('rule', 'i'), ('start', 'l'), ('end', 'l'), ('parent', 'i'), 
+           ('first_child', 'i'), ('next_sibling', 'i'), ('flags', 'b'))
+
+
+class FlatNode(object):
+    '''
+    Base class for the views of the FlatTree nodes.
+    '''
+    __slots__ = ()
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __reduce__(self):
+        return (type(self), (self.tree, self.index))
+
+    @property
+    def type(self):
+        return self.tree.names[self.tree.rule[self.index]]
+
+    @property
+    def position(self):
+        return self.tree.start[self.index]
+
+    @property
+    def end(self):
+        return self.tree.end[self.index]
+
+    @property
+    def error(self):
+        return bool(self.tree.flags[self.index] & ERROR)
+
+    @property
+    def parent(self):
+        parent = self.tree.parent[self.index]
+        if parent != -1:
+            return self.tree.node(parent)
+
+    @property
+    def comments(self):
+        comments = self.tree.comments.get(self.index)
+        if comments is not None:
+            return self.tree.node(comments)
+
+
+class FlatTerminal(FlatNode, Terminal):
+    '''
+    View of the terminal node of the FlatTree.
+    '''
+    __slots__ = ('tree', 'index')
+
+    @property
+    def value(self):
+        tree = self.tree
+        index = self.index
+        if index in tree.values:
+            return tree.values[index]
+        return tree.input[tree.start[index]:tree.end[index]]
+
+    @property
+    def _input(self):
+        if self.index not in self.tree.values:
+            return self.tree.input
+
+
+class FlatNonTerminal(FlatNode, NonTerminal):
+    '''
+    View of the non-terminal node of the FlatTree.
+    '''
+    __slots__ = ('tree', 'index')
+
+    @property
+    def nodes(self):
+        tree = self.tree
+        return [tree.node(child) for child in tree.children(self.index)]
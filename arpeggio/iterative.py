@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: iterative.py
+# Purpose: Parsing with an explicit stack
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#
+# Recursive parse methods of the parser model expressions use several
+# python frames for each nesting level of the input so deeply nested input
+# hits the recursion limit. The engine given here runs the same parser
+# model with the same semantics (parse trees, memoization, prediction,
+# NoMatch reports) but each non-terminal expression is parsed by a python
+# generator which yields the child expressions it wants parsed. Generators
+# are kept on an explicit stack so nesting depth is limited only by memory.
+#
+# Used by the parser if created with iterative=True.
+#
+# As the parse state is kept on the stack the engine can also stop after
+# any number of parser expressions and continue later. SlicedParse uses it
+# to parse the input in slices interleaved with other work, e.g. with the
+# other callbacks of the event loop:
+#
+#   parse = parser.parse_sliced(text)
+#   while not parse.run(seconds=0.005):
+#       ... # let the event loop run, parse.cancel() if the text is changed
+#   parse_tree = parse.parse_tree
+#######################################################################
+
+import copy
+import time
+from arpeggio import ParsingExpression, Match, Sequence, OrderedChoice, \
+    Optional, ZeroOrMore, OneOrMore, And, Not, NonTerminal, FAIL, SLICE, \
+    ArpeggioError, flatten
+
+
+class IterativeEngine(object):
+    '''
+    Parses the input of the given parser using an explicit stack.
+    '''
+    def __init__(self, parser):
+        self.parser = parser
+
+    def parse(self, expression):
+        '''
+        Equivalent to expression.parse(parser).
+        '''
+        tracer = self.parser._tracer
+        stack = []
+        value = self._start(expression, stack, tracer)
+        return self._run(stack, value, tracer)
+
+    def parse_steps(self, expression, steps):
+        '''
+        Generator version of parse. Yields SLICE after each given number of
+        parser expressions and the result of the expression at the end.
+        '''
+        tracer = self.parser._tracer
+        stack = []
+        value = self._start(expression, stack, tracer)
+        while stack:
+            value = self._run(stack, value, tracer, steps)
+            if stack:
+                yield SLICE
+        yield value
+
+    def _run(self, stack, value, tracer, steps=-1):
+        '''
+        Parses until the stack is empty or the given number of parser 
+        expressions is parsed.
+        @param value - the value sent to the generator on the top of the stack.
+        @returns - the value to send to the generator on the top of the
+                    stack or the result if the stack is empty.
+        '''
+        while stack and steps:
+            steps -= 1
+            request = stack[-1][0].send(value)
+            if isinstance(request, ParsingExpression):
+                # Child expression to parse.
+                value = self._start(request, stack, tracer)
+            else:
+                # Result of the expression on the top of the stack.
+                generator, expression, c_pos, position = stack.pop()
+                value = self._finish(expression, c_pos, request)
+                if tracer is not None:
+                    self._trace(tracer, expression, position, value)
+        return value
+
+    def _start(self, expression, stack, tracer):
+        '''
+        Starts parsing of the given expression. If the result is known at
+        once it is returned. Otherwise, the generator parsing the expression 
+        is pushed to the stack and None is returned to start it.
+        '''
+        parser = self.parser
+        position = None
+        if tracer is not None:
+            parser._skip_ws()
+            position = parser.position
+            tracer.on_enter(parser, expression, position)
+
+        expression_type = type(expression)
+        body = _GENERATORS.get(expression_type)
+        if body is not None:
+            # The same as ParsingExpression.parse up to the _parse call.
+            expression._parse_intro(parser)
+            c_pos = parser.position
+            if expression.memoize:
+                cached = parser.memo.get(expression, c_pos)
+                if cached is not None:
+                    result, parser.position = cached
+                    if tracer is not None:
+                        self._trace(tracer, expression, position, result)
+                    return result
+
+            # We are descending down
+            if parser.nm:
+                parser.nm._up = False
+
+            if expression.regular is None or not parser._regular:
+                stack.append((body(expression, parser, c_pos), expression,
+                              c_pos, position))
+                return None
+            result = self._finish(expression, c_pos, 
+                                  expression.regular.parse(parser))
+
+        elif isinstance(expression, Match) and \
+                expression_type.parse is Match.parse:
+            result = self._match(expression)
+        else:
+            # Unknown parser expression.
+            result = expression_type.parse(expression, parser)
+
+        if tracer is not None:
+            self._trace(tracer, expression, position, result)
+        return result
+
+    def _finish(self, expression, c_pos, result):
+        '''
+        The same as ParsingExpression.parse after the _parse call.
+        '''
+        parser = self.parser
+        if result is FAIL:
+            if expression.alias is not None:
+                expression._nm_alias(parser.nm, c_pos)
+            return result
+
+        if result:
+            if parser.reduce_tree:
+                if isinstance(result, list):
+                    if expression.root:
+                        result = flatten(result)
+                        if len(result) > 1:
+                            result = NonTerminal(expression.rule, c_pos, result)
+                        else:
+                            result = result[0]
+            else:
+                if expression.root:
+                    result = NonTerminal(expression.rule, c_pos, result)
+
+        if expression.memoize:
+            parser.memo.put(expression, c_pos, result, parser.position)
+
+        return result
+
+    def _trace(self, tracer, expression, position, result):
+        if result is FAIL:
+            tracer.on_fail(self.parser, expression, position)
+        else:
+            tracer.on_match(self.parser, expression, position, result)
+
+    def _match(self, match):
+        '''
+        The same as Match.parse. Comments are parsed by this engine (see
+        Parser._parse_comment).
+        '''
+        parser = self.parser
+        match._parse_intro(parser)
+        if parser._in_parse_comment:
+            return match._parse(parser)
+        result = match._parse(parser)
+        if result is FAIL and parser.comments_model:
+            # If not matched skip comments and try terminal match again
+            comments = parser._skip_comments()
+            if comments is not None:
+                # Failure after the comments is not registered as NoMatch.
+                parser._in_parse_comment = True
+                try:
+                    result = match._parse(parser)
+                finally:
+                    parser._in_parse_comment = False
+                if result is not FAIL:
+                    result = result.with_comments(comments)
+        return result
+
+
+class SlicedParse(object):
+    '''
+    Parse of the input done in slices by the run method. Created by
+    Parser.parse_sliced. The result is the same as the result of 
+    Parser.parse. The parse has its own parse context so other parses can
+    be done between the slices.
+    '''
+    def __init__(self, parser, _input, steps=1000):
+        '''
+        @param _input - input string.
+        @param steps - the number of parser expressions parsed in a slice.
+        '''
+        if parser.parser_model is None:
+            raise ArpeggioError("Parser without the parser model can't "
+                                "parse in slices.")
+        self.parser = parser
+        self.parse_tree = None
+        self.done = False
+        self._context = copy.copy(parser)
+        self._steps = self._context._parse_steps(_input, None, None, steps)
+
+    def run(self, seconds=None):
+        '''
+        Parses the next slice of the input. If seconds is given slices are
+        parsed until the given time passes. Raises NoMatch if the input
+        can't be parsed.
+        @returns - True if the parse is finished. The parse tree is in 
+                    parse_tree and the state of the parse is copied to the 
+                    parser as after Parser.parse.
+        '''
+        if self.done:
+            return True
+        if seconds is not None:
+            deadline = time.time() + seconds
+        finished = True
+        try:
+            for _ in self._steps:
+                if seconds is None or time.time() >= deadline:
+                    finished = False
+                    break
+        finally:
+            if finished:
+                self.done = True
+                self.parse_tree = self._context.parse_tree
+                self.parser._publish(self._context)
+        return finished
+
+    def cancel(self):
+        '''
+        Stops the parse. The parser is not changed.
+        '''
+        if not self.done:
+            self.done = True
+            self._steps.close()
+
+
+# Generators equivalent to _parse methods of the parser expressions.
+# Generator yields child expressions to parse and gets their results. The
+# first yielded value which is not a parser expression is the result.
+
+def _sequence(expression, parser, c_pos):
+    results = []
+    for e in expression.nodes:
+        result = yield e
+        if result is FAIL:
+            expression._nm_change_rule(parser.nm, c_pos)
+            yield result
+        if result:
+            results.append(result)
+    yield results
+
+
+def _ordered_choice(expression, parser, c_pos):
+    predict = None
+    if expression.first_table is not None and c_pos < len(parser.input):
+        predict = expression.first_table.get(parser.input[c_pos],
+                                             expression.first_default)
+
+    for i, e in enumerate(expression.nodes):
+        if predict is not None and not predict[i] and parser.nm is not None \
+                and parser.nm.position >= c_pos:
+            # See OrderedChoice._parse
+            if expression.skip_down[i]:
+                parser.nm._up = False
+            expression._nm_change_rule(parser.nm, c_pos)
+            continue
+        result = yield e
+        if result is not FAIL:
+            yield result
+        parser.position = c_pos # Backtracking
+        expression._nm_change_rule(parser.nm, c_pos)
+
+    yield FAIL
+
+
+def _optional(expression, parser, c_pos):
+    result = yield expression.nodes[0]
+    if result is FAIL:
+        parser.position = c_pos # Backtracking
+        result = None
+    yield result
+
+
+def _zero_or_more(expression, parser, c_pos):
+    results = []
+    while True:
+        c_pos = parser.position
+        result = yield expression.nodes[0]
+        if result is FAIL:
+            parser.position = c_pos # Backtracking
+            break
+        results.append(result)
+    yield results
+
+
+def _one_or_more(expression, parser, c_pos):
+    results = []
+    while True:
+        c_pos = parser.position
+        result = yield expression.nodes[0]
+        if result is FAIL:
+            parser.position = c_pos # Backtracking
+            if not results:
+                yield result
+            break
+        results.append(result)
+    yield results
+
+
+def _and(expression, parser, c_pos):
+    for e in expression.nodes:
+        if (yield e) is FAIL:
+            parser.position = c_pos
+            yield FAIL
+    if parser.position > parser._examined:
+        parser._examined = parser.position
+    parser.position = c_pos
+    yield None
+
+
+def _not(expression, parser, c_pos):
+    for e in expression.nodes:
+        if (yield e) is FAIL:
+            parser.position = c_pos
+            yield None
+    if parser.position > parser._examined:
+        parser._examined = parser.position
+    parser.position = c_pos
+    yield parser._nm_fail(expression.name, c_pos)
+
+
+_GENERATORS = {
+    Sequence: _sequence,
+    OrderedChoice: _ordered_choice,
+    Optional: _optional,
+    ZeroOrMore: _zero_or_more,
+    OneOrMore: _one_or_more,
+    And: _and,
+    Not: _not,
+}
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: optimize.py
+# Purpose: Parser model transformations
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#
+# Parser models built by ParserPython and PEG semantic actions often
+# contain redundant expressions (single-child sequences, sequences nested
+# in sequences etc.). Transformations given here rewrite the parser model
+# to an equivalent one with fewer expressions. Parse trees produced by the
+# rewritten model and NoMatch error reports are the same.
+#######################################################################
+
+from arpeggio import Match, StrMatch, RegExMatch, Sequence, OrderedChoice, \
+    Optional, ZeroOrMore, OneOrMore
+from arpeggio.analysis import model_nodes, reference_counts
+import logging
+
+logger = logging.getLogger('arpeggio.optimize')
+
+
+def may_return_none(expression):
+    '''
+    Can parsing of the given expression succeed with None as a result?
+    Sequence and repetition results are lists (maybe empty) and terminal
+    results are Terminal instances, but optionals and syntax predicates
+    return None. Ordered choice returns the result of its alternative.
+    '''
+    return _may_return_none(expression, set())
+
+
+def _may_return_none(expression, visited):
+    expression_type = type(expression)
+    if expression_type in (Sequence, ZeroOrMore, OneOrMore) \
+            or isinstance(expression, Match):
+        return False
+    if expression_type is OrderedChoice:
+        if id(expression) in visited:
+            return False
+        visited.add(id(expression))
+        return any(_may_return_none(e, visited) for e in expression.nodes)
+    return True
+
+
+def optimize(model, reduce_tree=False):
+    '''
+    Rewrites the given parser model in place. Transformations are:
+      - non-root sequences and ordered choices with a single child are
+        replaced by the child,
+      - non-root sequences nested in sequences are flattened,
+      - non-root ordered choices nested in non-root ordered choices are
+        flattened,
+      - optionals of optionals or zero or more repetitions are replaced by
+        the inner expression,
+      - if reduce_tree is used, rules which only forward to another rule
+        (single-child sequence or ordered choice) are replaced by the rule
+        they forward to. Such rules are always reduced from the parse tree
+        and thus never reach semantic actions.
+    Only expressions referenced from one place are replaced or flattened.
+    Rules (root expressions) are never changed, only the references to
+    pass-through rules. The rule a pass-through rule forwards to must be 
+    referenced only from it. Its alias is set to the name of the 
+    pass-through rule which NoMatch is changed to when it fails, as the
+    pass-through rule would do.
+    Parsing of a non-terminal expression sets NoMatch._up to False (see
+    ParsingExpression._nm_change_rule). To keep NoMatch reports the same,
+    expression is replaced or flattened only if the first expression parsed
+    in its place does the same, i.e. it is not a terminal and it is never 
+    found in the memoization table before its parent is.
+
+    @param model - the root of the parser model.
+    @param reduce_tree - will parse tree be reduced.
+    @returns - the new root of the parser model.
+    '''
+    refs = reference_counts(model)
+    visited = set()
+    stats = {'replaced': 0}
+
+    def inline(node):
+        '''
+        Can the given expression be replaced by its children?
+        '''
+        return not node.root and refs.get(id(node), 0) <= 1
+
+    def descends(node):
+        '''
+        Will parsing of the given expression always set NoMatch._up to 
+        False as its replaced parent would?
+        '''
+        return not isinstance(node, Match) and inline(node)
+
+    def simplify(node):
+        '''
+        Returns the expression to be used instead of the given one.
+        '''
+        while True:
+            node_type = type(node)
+            if node_type in (Sequence, OrderedChoice) and len(node.nodes) == 1:
+                child = node.nodes[0]
+                # Single-child sequence returns an empty list instead of
+                # None while None is kept in repetition results.
+                if inline(node) and descends(child) and \
+                        (node_type is OrderedChoice or not may_return_none(child)):
+                    node = child
+                    stats['replaced'] += 1
+                    continue
+                # Rule names are reported by NoMatch only for non-terminals.
+                if node.root and reduce_tree and child.root \
+                        and refs.get(id(child), 0) <= 1 \
+                        and not isinstance(child, Match) \
+                        and not may_return_none(child):
+                    logger.debug("Inlining pass-through rule %s." % node.rule)
+                    child.alias = node.alias or node.rule
+                    node = child
+                    stats['replaced'] += 1
+                    continue
+            elif node_type is Optional and inline(node) \
+                    and type(node.nodes[0]) in (Optional, ZeroOrMore) \
+                    and descends(node.nodes[0]):
+                node = node.nodes[0]
+                stats['replaced'] += 1
+                continue
+            return node
+
+    def visit(node):
+        if id(node) in visited:
+            return
+        visited.add(id(node))
+
+        nodes = []
+        for child in node.nodes:
+            child = simplify(child)
+            visit(child)
+            node_type = type(node)
+            if type(child) is node_type and inline(child) \
+                    and child.nodes and descends(child.nodes[0]) and (
+                    node_type is Sequence or
+                    (node_type is OrderedChoice and not node.root)):
+                nodes.extend(child.nodes)
+                stats['replaced'] += 1
+            else:
+                nodes.append(child)
+        node.nodes[:] = nodes
+
+    model = simplify(model)
+    visit(model)
+    logger.debug("Optimization: %d expressions removed." % stats['replaced'])
+    return model
+
+
+def _same(a, b):
+    '''
+    Will the given expressions always produce the same result?
+    '''
+    if a is b:
+        return True
+    if type(a) is not type(b) or a.root != b.root or a.rule != b.rule \
+            or type(a) not in (StrMatch, RegExMatch):
+        return False
+    if type(a) is RegExMatch:
+        return a.to_match == b.to_match and a.regex.flags == b.regex.flags
+    return a.to_match == b.to_match
+
+
+def _elements(alternative):
+    '''
+    Returns the list of expressions matched in sequence by the alternative.
+    '''
+    if type(alternative) is Sequence and not alternative.root:
+        return alternative.nodes
+    return [alternative]
+
+
+def _factor(alternatives):
+    '''
+    Returns the new list of alternatives where adjacent alternatives starting
+    with the same expressions are replaced by the common prefix followed by
+    the ordered choice of the rest.
+    '''
+    result = []
+    i = 0
+    while i < len(alternatives):
+        first = _elements(alternatives[i])
+        j = i + 1
+        if first and not may_return_none(first[0]):
+            while j < len(alternatives):
+                elements = _elements(alternatives[j])
+                if not elements or not _same(first[0], elements[0]):
+                    break
+                j += 1
+        if j - i == 1:
+            result.append(alternatives[i])
+            i += 1
+            continue
+
+        group = [_elements(a) for a in alternatives[i:j]]
+        prefix = 1
+        while all(len(e) > prefix for e in group) and \
+                not may_return_none(first[prefix]) and \
+                all(_same(first[prefix], e[prefix]) for e in group):
+            prefix += 1
+        rest = []
+        for elements in group:
+            elements = elements[prefix:]
+            if len(elements) == 1 and not may_return_none(elements[0]):
+                rest.append(elements[0])
+            else:
+                rest.append(Sequence(nodes=list(elements)))
+        logger.debug("Left-factoring %d alternatives." % len(group))
+        result.append(Sequence(nodes=first[:prefix] +
+                               [OrderedChoice(nodes=_factor(rest))]))
+        i = j
+    return result
+
+
+def left_factor(model):
+    '''
+    Rewrites ordered choices of the given parser model in place so that the
+    common prefix of adjacent alternatives is matched only once, e.g.
+    A B / A C / D is changed to A (B / C) / D. 
+    As PEG expression always matches the same way at the given position the
+    language is not changed. Parse trees are the same as results of non-root
+    sequences are flattened in the parse tree. Only alternatives which are
+    not rules and prefix expressions which can't return None are factored.
+    NoMatch error reports may differ as alternatives are tried in the
+    different order of expressions.
+
+    @param model - the root of the parser model.
+    '''
+    for node in model_nodes(model):
+        if type(node) is OrderedChoice:
+            node.nodes[:] = _factor(node.nodes)
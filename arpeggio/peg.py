@@ -5,12 +5,26 @@
 # Author: Igor R. Dejanovic <igor DOT dejanovic AT gmail DOT com>
 # Copyright: (c) 2009 Igor R. Dejanovic <igor DOT dejanovic AT gmail DOT com>
 # License: MIT License
+#
+# Building the parser model from the PEG language is much slower than
+# loading it. If ParserPEG is given the cache directory the finished parser
+# model is pickled there and loaded by the next parser created with the
+# same grammar and options:
+#
+#   parser = ParserPEG(calc_grammar, "calc", cache_dir=".arpeggio_cache")
 #######################################################################
 
 __all__ = ['ParserPEG']
 
 from arpeggio import *
 from arpeggio import RegExMatch as _
+from arpeggio import __version__, MODEL_FORMAT
+import os
+import copy
+import hashlib
+import threading
+import tempfile
+import cPickle
 import logging
 
 logger = logging.getLogger('arpeggio.peg')
@@ -66,6 +80,10 @@ class SemRule(PEGSemanticAction):
         rule_name = nodes[0].value
         if len(nodes)>4:
             retval = Sequence(nodes=nodes[2:-1])
+        elif isinstance(nodes[2], Terminal):
+            # Rule which is just a reference to another rule. Reference is
+            # resolved in the second pass.
+            retval = Sequence(nodes=[nodes[2]])
         else:
             retval = nodes[2]
         retval.rule = rule_name
@@ -173,12 +191,48 @@ identifier.sem = SemIdentifier()
 literal.sem = SemLiteral()
 for sem in [LEFT_ARROW, SLASH, STAR, QUESTION, PLUS, AND, NOT, OPEN, CLOSE]:
     sem.sem = SemTerminal()
+
+
+# Parser of the PEG language which is copied by _meta_parser.
+_meta = None
+_meta_lock = threading.Lock()
+
+def _meta_parser():
+    '''
+    @returns - new parser of the PEG language. Its parser model is built by
+                the first call and shared by all returned parsers. Parsing
+                doesn't change the model so the parsers can be used at the
+                same time from different threads.
+    '''
+    global _meta
+    if _meta is None:
+        with _meta_lock:
+            if _meta is None:
+                _meta = ParserPython(grammar, comment)
+    return copy.copy(_meta)
     
     
 class ParserPEG(Parser):
-    def __init__(self, language_def, root_rule_name, comment_rule_name=None, skipws=True, ws=DEFAULT_WS):
-        super(ParserPEG, self).__init__(skipws, ws)
+    def __init__(self, language_def, root_rule_name, comment_rule_name=None, *args, **kwargs):
+        '''
+        @param language_def - grammar in the PEG language.
+        @param root_rule_name - the name of the root rule of the grammar.
+        @param comment_rule_name - the name of the rule matching comments.
+        @param cache_dir - keyword only. Directory where the parser models are
+                        cached or None.
+        '''
+        cache_dir = kwargs.pop('cache_dir', None)
+        super(ParserPEG, self).__init__(*args, **kwargs)
         self.root_rule_name = root_rule_name
+        self._init_args = (language_def, root_rule_name, comment_rule_name)
+        self._init_kwargs['cache_dir'] = cache_dir
+
+        cache_file = None
+        if cache_dir is not None:
+            cache_file = os.path.join(cache_dir, "%s.pickle" % 
+                self._cache_key(language_def, comment_rule_name))
+            if self._load_model(cache_file):
+                return
         
         # PEG Abstract Syntax Graph
         self.parser_model = self._from_peg(language_def)
@@ -187,15 +241,79 @@ class ParserPEG(Parser):
         if self.comments_model: # and not isinstance(self.comments_model, ZeroOrMore):
             self.comments_model.root = True
             self.comments_model.rule = comment_rule_name
-            
-    def _parse(self):
-        return self.parser_model.parse(self)
 
+        self._init_model()
+
+        if cache_file is not None:
+            self._save_model(cache_file)
+            
     def _from_peg(self, language_def):
-        parser = ParserPython(grammar, comment)
+        parser = _meta_parser()
         parser.root_rule_name = self.root_rule_name
         parse_tree = parser.parse(language_def)
         return parser.getASG()
+
+    def _cache_key(self, language_def, comment_rule_name):
+        '''
+        @returns - hash of the grammar and of the options used to build the
+                    parser model.
+        '''
+        key = (__version__, MODEL_FORMAT, language_def, self.root_rule_name, 
+               comment_rule_name, self._model_options())
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    def _load_model(self, file_name):
+        '''
+        Loads the parser model cached by _save_model.
+        @returns - False if the model is not in the cache.
+        '''
+        try:
+            f = open(file_name, "rb")
+        except IOError:
+            return False
+        try:
+            try:
+                self.parser_model, self.comments_model, self._regular = \
+                    cPickle.load(f)
+            except Exception, e:
+                logger.warning("Can't load cached parser model %s: %s" % 
+                               (file_name, e))
+                return False
+        finally:
+            f.close()
+        logger.debug("Parser model loaded from %s." % file_name)
+        return True
+
+    def _save_model(self, file_name):
+        '''
+        Pickles the parser model to the cache. File is written under a 
+        temporary name and renamed so parsers created at the same time 
+        never load a partially written model. The cache is not required 
+        so the errors are only logged.
+        '''
+        try:
+            cache_dir = os.path.dirname(file_name)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, tmp_name = tempfile.mkstemp(dir=cache_dir)
+            try:
+                f = os.fdopen(fd, "wb")
+                try:
+                    # Parser model classes have __slots__ which require 
+                    # the protocol 2.
+                    cPickle.dump((self.parser_model, self.comments_model, 
+                                  self._regular), f, cPickle.HIGHEST_PROTOCOL)
+                finally:
+                    f.close()
+                os.rename(tmp_name, file_name)
+            finally:
+                # Left if dumping failed or, on Windows, if the model was
+                # cached by another parser in the meantime.
+                if os.path.exists(tmp_name):
+                    os.remove(tmp_name)
+        except (EnvironmentError, cPickle.PicklingError, RuntimeError), e:
+            logger.warning("Can't cache parser model to %s: %s" % 
+                           (file_name, e))
     
 if __name__ == "__main__":
     try:
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: pool.py
+# Purpose: Parsing of many inputs in worker processes
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#
+# Inputs are parsed in parallel by a pool of worker processes:
+#
+#   parser = ParserPython(calc, flat=True)
+#   for result, error in parser.parse_many(file_names, files=True):
+#       ...
+#
+# The parser is given to each worker once, when the worker is started.
+# Where the workers are forked it is inherited. Otherwise it is pickled as
+# the arguments it was created with and the worker builds its parser model
+# from the rule functions or the PEG grammar (see Parser.__reduce__).
+# So that parse_many works the same on all platforms the parser is checked
+# to be picklable before the workers are started, e.g. its rule functions,
+# memo factory and tracer must be defined at the module level.
+# Inputs are sent to the workers in chunks so the cost of sending each
+# input is small. If files is True only the file names are sent and the
+# workers read the files.
+#
+# Results are pickled back to this process. Workers keep the parse trees
+# in arrays (see arpeggio.flat) as they are pickled tens of times faster
+# than the trees of objects and their depth is not limited by the
+# recursion limit. Returned parse trees are the views of FlatTree nodes.
+#######################################################################
+
+import copy
+import pickle
+import multiprocessing
+from arpeggio import NoMatch, ArpeggioError
+
+# Parser and the options of the worker process (see _init_worker).
+_worker = None
+
+
+def parse_many(parser, inputs, workers=None, files=False, asg=False):
+    '''
+    See Parser.parse_many
+    '''
+    inputs = list(inputs)
+    if workers == 1:
+        _init_worker(parser, files, asg)
+        try:
+            return map(_parse_one, inputs)
+        finally:
+            _init_worker(None, None, None)
+    _check_picklable(parser)
+    pool = multiprocessing.Pool(workers, _init_worker, (parser, files, asg))
+    try:
+        # Inputs are split to a few chunks for each worker.
+        results = pool.map(_parse_one, inputs)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return results
+
+
+def _check_picklable(parser):
+    '''
+    Raises ArpeggioError if the parser can't be sent to the workers which
+    are not forked.
+    '''
+    try:
+        pickle.dumps(parser, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError), e:
+        raise ArpeggioError("Parser can't be sent to the worker processes "
+                            "as the arguments it is created with can't be "
+                            "pickled: %s" % e)
+
+
+def _init_worker(parser, files, asg):
+    global _worker
+    if parser is not None and not asg and not parser.flat:
+        parser = copy.copy(parser)
+        parser.flat = True
+    _worker = (parser, files, asg)
+
+
+def _parse_one(input):
+    '''
+    Parses a single input in the worker process.
+    @returns - (result, error) tuple.
+    '''
+    parser, files, asg = _worker
+    try:
+        if files:
+            f = open(input)
+            try:
+                result = parser.parse(f)
+            finally:
+                f.close()
+        else:
+            result = parser.parse(input)
+        if asg:
+            result = parser.getASG()
+        return result, None
+    except NoMatch, e:
+        # Parser of the NoMatch is not sent back (see NoMatch.__reduce__).
+        e.line_col = e.parser.pos_to_linecol(e.position)
+        return None, e
+    except Exception, e:
+        return None, e
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: regular.py
+# Purpose: Matching of regular sub-grammars by a single regular expression
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#
+# Parser expression is regular if it is not recursive and is built only of
+# terminals, sequences, ordered choices, repetitions and syntax predicates.
+# Such expression is compiled to a single python regular expression which
+# is matched in one call instead of matching the expression node by node.
+# PEG semantics is kept by matching ordered choices, repetitions, optionals
+# and regex terminals as atomic groups (emulated by a lookahead with a
+# backreference) so the regex engine never backtracks into them. Parse tree
+# is rebuilt from the groups of the match.
+#######################################################################
+
+import re
+import sre_parse
+import sre_constants
+import logging
+from arpeggio import Match, StrMatch, Kwd, RegExMatch, \
+    EndOfFile, Sequence, OrderedChoice, Optional, ZeroOrMore, OneOrMore, \
+    And, Not, Terminal, LazyTerminal, NonTerminal, flatten
+from arpeggio.analysis import first_sets
+
+logger = logging.getLogger('arpeggio.regular')
+
+_REPETITIONS = (Optional, ZeroOrMore, OneOrMore)
+_PREDICATES = (And, Not)
+
+
+def _atomic(source, group):
+    '''
+    Returns the source of the atomic group matching the given source.
+    Backreference is terminated by an empty group so that the digits of
+    the following source are not taken as a part of the group number.
+    '''
+    return "(?=(%s))\\%d(?:)" % (source, group)
+
+
+class _Plan(object):
+    '''
+    Describes how the result of the expression is rebuilt from the match.
+    '''
+    def __init__(self, expression, group=None, children=None, markers=None):
+        self.expression = expression
+        self.type = type(expression) # class of the expression
+        self.group = group          # group of the terminal or atomic group
+        self.children = children    # plans of the child expressions or
+                                    # RegularExpression of the repetition body
+        self.markers = markers      # groups marking matched alternative
+
+
+class RegularExpression(object):
+    '''
+    Regular parser expression compiled to a single regular expression.
+    '''
+    def __init__(self, expression, skipws, ws, firsts):
+        '''
+        @param expression - regular parser expression.
+        @param skipws, ws - whitespace handling of the parser.
+        @param firsts - FIRST sets of the parser model (see
+                        arpeggio.analysis.first_sets)
+        '''
+        self.expression = expression
+        self.skipws = skipws
+        self.ws = ws
+        self.firsts = firsts
+        self._groups = 0
+        source, self.plan = self._compile(expression)
+        self.regex = re.compile(source)
+        if skipws and ws:
+            self._ws_regex = re.compile(self._ws_class())
+
+    def _ws_class(self):
+        return "[%s]*" % "".join(re.escape(c) for c in self.ws)
+
+    def _group(self, count=1):
+        '''
+        Allocates count groups and returns the index of the first one.
+        Groups are numbered in the order of their opening parentheses so
+        allocations must follow the order of the generated source.
+        '''
+        group = self._groups + 1
+        self._groups += count
+        return group
+
+    def _ws(self, match):
+        '''
+        Whitespace skipping before the given terminal.
+        '''
+        if not self.skipws or not self.ws:
+            return ""
+        chars = self.firsts[id(match)][0]
+        if chars is not None and not any(c in self.ws for c in chars):
+            return self._ws_class()
+        # Terminal can start with a whitespace so skipping must be atomic.
+        return _atomic(self._ws_class(), self._group())
+
+    def _compile(self, e):
+        '''
+        Returns the source of the regular expression for the given parser
+        expression and the plan for rebuilding its result.
+        '''
+        e_type = type(e)
+        if e_type in (StrMatch, Kwd):
+            return self._ws(e) + re.escape(e.to_match), _Plan(e)
+        elif e_type is RegExMatch:
+            ws = self._ws(e)
+            group = self._group(1 + e.regex.groups)
+            return ws + _atomic(e.to_match, group), _Plan(e, group)
+        elif e_type is EndOfFile:
+            return self._ws(e) + r"\Z", _Plan(e)
+        elif e_type is Sequence:
+            sources, plans = [], []
+            for n in e.nodes:
+                source, plan = self._compile(n)
+                sources.append(source)
+                plans.append(plan)
+            return "".join(sources), _Plan(e, children=plans)
+        elif e_type is OrderedChoice:
+            group = self._group()
+            sources, plans, markers = [], [], []
+            for n in e.nodes:
+                source, plan = self._compile(n)
+                markers.append(self._group())
+                sources.append("(?:%s)()" % source)
+                plans.append(plan)
+            return _atomic("|".join(sources), group), \
+                _Plan(e, group, plans, markers)
+        elif e_type in _REPETITIONS:
+            group = self._group()
+            source, plan = self._compile(e.nodes[0])
+            quantifier = {Optional: "?", ZeroOrMore: "*", OneOrMore: "+"}[e_type]
+            if e_type is not Optional:
+                # Each repetition is rebuilt by matching the body.
+                plan = RegularExpression(e.nodes[0], self.skipws, self.ws,
+                                         self.firsts)
+            return _atomic("(?:%s)%s" % (source, quantifier), group), \
+                _Plan(e, group, [plan])
+        elif e_type in _PREDICATES:
+            source = "".join(self._compile(n)[0] for n in e.nodes)
+            return ("(?=%s)" if e_type is And else "(?!%s)") % source, _Plan(e)
+        raise ValueError("Not a regular expression: %s" % e.name)
+
+    def parse(self, parser):
+        '''
+        Used instead of the _parse method of the expression.
+        '''
+        c_pos = parser.position
+        m = self.regex.match(parser.input, c_pos)
+        if m is None:
+            return parser._nm_fail(self.expression.name, c_pos)
+        result, parser.position = self._build(self.plan, m, parser.input,
+                                              c_pos, parser.reduce_tree)
+        return result
+
+    def _build(self, plan, m, _input, pos, reduce_tree, intro=False):
+        '''
+        Rebuilds the result of the expression the way its parse method would
+        produce it.
+        @param intro - skip whitespaces and wrap the result of the root
+                        expression (done by the parse method for the
+                        expression this regular expression is used for).
+        @returns - (result, new position) tuple.
+        '''
+        e = plan.expression
+        if intro and self.skipws and self.ws:
+            pos = self._ws_regex.match(_input, pos).end()
+        c_pos = pos
+        e_type = plan.type
+        result = None
+        if e_type in (StrMatch, Kwd):
+            result = Terminal(e.rule if e.root else '', pos, e.to_match)
+            return result, result.end
+        elif e_type is RegExMatch:
+            pos = m.end(plan.group)
+            return LazyTerminal(e.rule if e.root else '', c_pos, pos, 
+                                _input), pos
+        elif e_type is EndOfFile:
+            return Terminal(e.rule if e.root else '', pos, 'EOF', False, 
+                            pos), pos
+        elif e_type is Sequence:
+            result = []
+            for child in plan.children:
+                r, pos = self._build(child, m, _input, pos, reduce_tree, True)
+                if r:
+                    result.append(r)
+        elif e_type is OrderedChoice:
+            for i, child in enumerate(plan.children):
+                if m.start(plan.markers[i]) != -1:
+                    result, pos = self._build(child, m, _input, pos,
+                                              reduce_tree, True)
+                    break
+        elif e_type is Optional:
+            if m.end(plan.group) > m.start(plan.group):
+                result, pos = self._build(plan.children[0], m, _input, pos,
+                                          reduce_tree, True)
+        elif e_type in _REPETITIONS:
+            body = plan.children[0]
+            end = m.end(plan.group)
+            result = []
+            while pos < end:
+                r, pos = body._build(body.plan, body.regex.match(_input, pos),
+                                     _input, pos, reduce_tree, True)
+                result.append(r)
+
+        if intro and result and e.root:
+            # The same as in ParsingExpression.parse
+            if reduce_tree:
+                if isinstance(result, list):
+                    result = flatten(result)
+                    if len(result) > 1:
+                        result = NonTerminal(e.rule, c_pos, result)
+                    else:
+                        result = result[0]
+            else:
+                result = NonTerminal(e.rule, c_pos, result)
+        return result, pos
+
+
+def _plain_regex(regex):
+    '''
+    Can the given compiled regex be embedded in a larger regular expression?
+    Flags, named groups and backreferences would change the meaning of the
+    rest of the expression or depend on the group numbering.
+    '''
+    if regex.flags or regex.groupindex:
+        return False
+    def plain(items):
+        for op, av in items:
+            if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+                return False
+            for a in (av if isinstance(av, (list, tuple)) else [av]):
+                if isinstance(a, sre_parse.SubPattern) and not plain(a):
+                    return False
+                if isinstance(a, (list, tuple)):
+                    for b in a:
+                        if isinstance(b, sre_parse.SubPattern) and not plain(b):
+                            return False
+        return True
+    try:
+        return plain(sre_parse.parse(regex.pattern))
+    except Exception:
+        return False
+
+
+def regular_analysis(model, skipws, ws):
+    '''
+    Finds maximal regular expressions of the given parser model and sets
+    their regular attribute to the compiled RegularExpression.
+    Terminals are not compiled as they are already matched in one call.
+
+    @param model - the root of the parser model.
+    @param skipws, ws - whitespace handling of the parser.
+    @returns - the number of expressions compiled.
+    '''
+    firsts = first_sets(model)
+    regular = {}
+
+    def is_regular(e):
+        if id(e) in regular:
+            # Expression in progress is recursive.
+            return regular[id(e)]
+        regular[id(e)] = False
+        e_type = type(e)
+        if e_type in (StrMatch, Kwd, EndOfFile):
+            result = True
+        elif e_type is RegExMatch:
+            result = _plain_regex(e.regex)
+        elif e_type in (Sequence, OrderedChoice) + _PREDICATES:
+            result = all([is_regular(n) for n in e.nodes])
+        elif e_type in _REPETITIONS:
+            # Body must consume input to tell whether it is matched.
+            result = is_regular(e.nodes[0]) and not firsts[id(e.nodes[0])][1]
+        else:
+            result = False
+        regular[id(e)] = result
+        return result
+
+    compiled = 0
+    visited = set()
+    to_visit = [model]
+    while to_visit:
+        node = to_visit.pop()
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        if not isinstance(node, Match) and is_regular(node):
+            try:
+                node.regular = RegularExpression(node, skipws, ws, firsts)
+                compiled += 1
+                logger.debug("Regular expression for %s: %s" %
+                             (node.name, node.regular.regex.pattern))
+                continue
+            except Exception, e:
+                # E.g. too many groups.
+                logger.debug("Can't compile %s: %s" % (node.name, e))
+        to_visit.extend(node.nodes)
+    logger.debug("Regular analysis: %d expressions compiled." % compiled)
+    return compiled
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: stream.py
+# Purpose: Parsing of the input read from a file object
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#
+# File object given to Parser.parse is read in chunks on demand:
+#
+#   parser.parse(open('big.txt'))
+#   parser.parse(StreamInput(open('big.txt'), chunk_size=1024*1024))
+#
+# Parser expressions match the buffer of the input read so far. If the
+# root rule of the grammar is a sequence with a repetition (e.g.
+# program <- header item* EOF) each matched item of the repetition is a
+# commit point: the parser never backtracks behind it so the buffered text
+# and the memoized results before it are dropped. Memory used for the input
+# depends on the size of the largest item and not on the size of the file.
+# Parse tree is kept whole. If the parser keeps the parse tree in arrays
+# (see arpeggio.flat) each item is moved to them when it is matched.
+# Input of other grammars is read whole before parsing.
+#
+# Result of the expression is trusted only if at least lookahead characters
+# are buffered after the furthest position the parser reached. Otherwise
+# the next chunk is read and the expression is parsed again.
+#######################################################################
+
+from arpeggio import ParseTreeNode, NonTerminal, Sequence, ZeroOrMore, \
+    OneOrMore, FAIL, flatten, _shift_positions
+
+
+class StreamInput(object):
+    '''
+    Input read from a file object on demand.
+    '''
+    def __init__(self, file_obj, chunk_size=65536, lookahead=1024):
+        '''
+        @param file_obj - object with the read(size) method.
+        @param chunk_size - the number of characters read at once.
+        @param lookahead - the number of characters that must be buffered
+                        after the furthest position reached by the parser.
+                        Should be larger than any terminal match or regex
+                        lookahead.
+        '''
+        self.file = file_obj
+        self.chunk_size = chunk_size
+        self.lookahead = lookahead
+        self.buffer = ''
+        self.offset = 0     # input position of the first buffered character
+        self.line = 0       # the number of lines before the buffer
+        self.col = 0        # the number of characters of the line before
+                            # the buffer
+        self.eof = False
+        self.dropped = None # list of the dropped text if it is kept
+
+    def read(self):
+        '''
+        Appends the next chunk of the input to the buffer.
+        @returns - False if the end of the input is reached.
+        '''
+        if not self.eof:
+            # Growing the chunks with the buffer keeps appending linear.
+            chunk = self.file.read(max(self.chunk_size, len(self.buffer)))
+            if chunk:
+                self.buffer += chunk
+            else:
+                self.eof = True
+        return not self.eof
+
+    def read_all(self):
+        '''
+        Reads the rest of the input.
+        @returns - the buffered input.
+        '''
+        while self.read():
+            pass
+        return self.buffer
+
+    def drop(self, count):
+        '''
+        Drops count characters from the beginning of the buffer.
+        '''
+        text = self.buffer[:count]
+        if self.dropped is not None:
+            self.dropped.append(text)
+        newlines = text.count('\n')
+        if newlines:
+            self.line += newlines
+            self.col = count - text.rindex('\n') - 1
+        else:
+            self.col += count
+        self.buffer = self.buffer[count:]
+        self.offset += count
+
+
+def _repetition_index(model):
+    '''
+    Returns the index of the repetition whose items are commit points in
+    the root sequence of the given parser model or None.
+    '''
+    if type(model) is Sequence:
+        for i, e in enumerate(model.nodes):
+            if type(e) in (ZeroOrMore, OneOrMore):
+                return i
+
+
+def streamable(model):
+    '''
+    Can the buffered input be dropped while parsing with the given parser
+    model?
+    '''
+    return _repetition_index(model) is not None
+
+
+def parse_stream(parser, stream):
+    '''
+    Parses the input read from the stream with the streamable parser model.
+    Parser state is prepared by Parser.parse. Positions in the parse tree
+    and in the NoMatch are positions in the whole input.
+    @returns - the parse tree or FAIL.
+    '''
+    # Regular expressions don't register NoMatch for the expressions inside
+    # them and the input can't be parsed again to report the error.
+    regular = parser._regular
+    parser._regular = False
+    tree = None
+    if parser.flat:
+        from arpeggio.flat import FlatTree
+        tree = FlatTree()
+        # Terminal values are slices of the whole input.
+        stream.dropped = []
+    try:
+        result = _parse_root(parser, stream, tree)
+        if tree is not None and isinstance(result, ParseTreeNode):
+            tree.input = ''.join(stream.dropped) + stream.buffer
+            result = tree.node(tree.add(result))
+    finally:
+        parser._regular = regular
+        stream.dropped = None
+    if result is FAIL:
+        parser.nm.position += stream.offset
+    return result
+
+
+def _parse_root(parser, stream, tree):
+    '''
+    The same as parse of the root sequence of the parser model with the
+    commit after each item of its repetition.
+    @param tree - FlatTree the items are moved to or None.
+    '''
+    model = parser.parser_model
+    index = _repetition_index(model)
+    if parser.iterative or parser._tracer is not None:
+        from arpeggio.iterative import IterativeEngine
+        parse = IterativeEngine(parser).parse
+    else:
+        parse = lambda e: e.parse(parser)
+
+    _window(parser, stream, parser._skip_ws)
+    c_pos = parser.position + stream.offset
+    if parser.nm:
+        parser.nm._up = False
+
+    results = []
+    for i, e in enumerate(model.nodes):
+        if i == index:
+            result = _parse_repetition(parser, stream, e, parse, tree)
+        else:
+            result = _window(parser, stream, lambda: parse(e))
+            _shift_positions(result, stream.offset)
+        if result is FAIL:
+            model._nm_change_rule(parser.nm, c_pos - stream.offset)
+            if model.alias is not None:
+                model._nm_alias(parser.nm, c_pos - stream.offset)
+            return result
+        if result:
+            results.append(result)
+    return _wrap(parser, model, c_pos, results)
+
+
+def _parse_repetition(parser, stream, repetition, parse, tree):
+    _window(parser, stream, parser._skip_ws)
+    c_pos = parser.position + stream.offset
+    if parser.nm:
+        parser.nm._up = False
+
+    item = repetition.nodes[0]
+    parse_item = lambda: parse(item)
+    results = []
+    while True:
+        position = parser.position
+        result = _window(parser, stream, parse_item)
+        if result is FAIL:
+            parser.position = position # Backtracking
+            if not results and type(repetition) is OneOrMore:
+                return result
+            break
+        _shift_positions(result, stream.offset)
+        if tree is not None:
+            result = _flatten_item(tree, stream, result)
+        results.append(result)
+        _commit(parser, stream)
+    return _wrap(parser, repetition, c_pos, results)
+
+
+def _window(parser, stream, parse):
+    '''
+    Calls parse reading more input until its result can't be changed by the
+    input not yet read.
+    @returns - the result of parse.
+    '''
+    start = parser.position
+    nm = parser.nm
+    if nm is not None:
+        nm_state = (nm.value, nm.position, nm._up)
+    while True:
+        result = parse()
+        furthest = start if result is FAIL else parser.position
+        if parser.nm is not None and parser.nm.position > furthest:
+            furthest = parser.nm.position
+        if stream.eof or furthest + stream.lookahead < len(stream.buffer):
+            return result
+
+        # Parse again with more input.
+        parser.position = start
+        parser.nm = nm
+        if nm is not None:
+            nm.value, nm.position, nm._up = nm_state
+        stream.read()
+        parser._set_input(stream.buffer)
+        # Results near the end of the buffer may be different.
+        parser.memo = parser._new_memo()
+
+
+def _commit(parser, stream):
+    '''
+    Drops the buffered input and the memoized results before the current
+    position. They are dropped at least a chunk at a time to avoid copying
+    the buffer after each item.
+    '''
+    position = parser.position
+    if position < stream.chunk_size:
+        return
+    parser.memo = parser._new_memo()
+    stream.drop(position)
+    parser._set_input(stream.buffer)
+    parser.position = 0
+    if parser.nm is not None:
+        parser.nm.position -= position
+
+
+def _flatten_item(tree, stream, result):
+    '''
+    Moves the parse tree nodes of the matched item to the flat tree.
+    @returns - the result with the nodes replaced by their views.
+    '''
+    if isinstance(result, list):
+        return [_flatten_item(tree, stream, r) for r in result]
+    if isinstance(result, ParseTreeNode):
+        return tree.node(tree._add(result, stream.buffer, stream.offset))
+    return result
+
+
+def _wrap(parser, expression, c_pos, result):
+    '''
+    The same as in ParsingExpression.parse
+    '''
+    if result:
+        if parser.reduce_tree:
+            if isinstance(result, list):
+                if expression.root:
+                    result = flatten(result)
+                    if len(result) > 1:
+                        result = NonTerminal(expression.rule, c_pos, result)
+                    else:
+                        result = result[0]
+        else:
+            if expression.root:
+                result = NonTerminal(expression.rule, c_pos, result)
+    return result
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: tracing.py
+# Purpose: Tracing of the parsing process
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#
+# Tracer is given to the parser:
+#
+#   parser = ParserPython(calc, tracer=MyTracer())
+#
+# or set later (parser.tracer = MyTracer()). Traced parse is done by the
+# iterative engine (see arpeggio.iterative) which calls the tracer, so
+# parsing without the tracer is not slowed down at all. If no tracer is
+# given and the 'arpeggio' logger is enabled for DEBUG level DebugTracer
+# is used. The tracer belongs to the parse context (see 
+# Parser._parse_input) and the parser model is not changed, so it may be
+# shared by the traced and untraced parses running at the same time.
+#
+# Inner expressions of the expressions matched by a regular expression
+# (see arpeggio.regular) are not traced. Generated parsers (see
+# arpeggio.codegen) report only memoization hits.
+#######################################################################
+
+from arpeggio import Match
+import logging
+
+logger = logging.getLogger('arpeggio')
+
+
+class Tracer(object):
+    '''
+    Base class for tracers. Methods are called by the parser during parsing.
+    Position is the input position after whitespace skipping.
+    '''
+    def on_enter(self, parser, expression, position):
+        '''
+        Called when the parser expression is about to be matched.
+        '''
+
+    def on_match(self, parser, expression, position, result):
+        '''
+        Called when the parser expression matched. Input is consumed up to
+        parser.position.
+        '''
+
+    def on_fail(self, parser, expression, position):
+        '''
+        Called when the parser expression didn't match. The furthest failure
+        is in parser.nm.
+        '''
+
+    def on_memo_hit(self, parser, expression, position, result):
+        '''
+        Called when the result of the parser expression is found in the
+        memoization table.
+        '''
+
+
+class DebugTracer(Tracer):
+    '''
+    Writes parsing trace to the debug log.
+    '''
+    def on_enter(self, parser, expression, position):
+        logger.debug("Parsing %s" % expression.name)
+
+    def on_match(self, parser, expression, position, result):
+        if isinstance(expression, Match):
+            logger.debug("Match %s at %d" % (result, position))
+
+    def on_fail(self, parser, expression, position):
+        if isinstance(expression, Match):
+            logger.debug("NoMatch at %d" % position)
+
+    def on_memo_hit(self, parser, expression, position, result):
+        logger.debug("Result for [%s, %s] founded in memo." % (expression, position))
+
+
+class TracingMemo(object):
+    '''
+    Memoization table wrapper which reports hits to the tracer.
+    '''
+    def __init__(self, memo, parser, tracer):
+        self.memo = memo
+        self.parser = parser
+        self.tracer = tracer
+
+    def get(self, expression, position):
+        cached = self.memo.get(expression, position)
+        if cached is not None:
+            self.tracer.on_memo_hit(self.parser, expression, position, cached[0])
+        return cached
+
+    def put(self, expression, position, result, new_position):
+        self.memo.put(expression, position, result, new_position)
+
+    def __len__(self):
+        return len(self.memo)
+
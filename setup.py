@@ -12,9 +12,10 @@
 #######################################################################
 
 __author__ = "Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>"
-__version__ = "0.1-dev"
 
 from setuptools import setup
+# Version is kept in the package.
+from arpeggio import __version__
 
 NAME = 'Arpeggio'
 VERSION = __version__
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: tests
+# Purpose: Arpeggio tests
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#
+# Run from the project directory with:
+#
+#   python -m unittest discover -s tests -t .
+#######################################################################
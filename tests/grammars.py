@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: grammars.py
+# Purpose: Grammars and inputs shared by the tests
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#
+# Grammars of the examples are parsed by the parser created with the
+# default options. Results of the other engines and options are compared
+# with its results.
+#######################################################################
+
+import os
+import imp
+from arpeggio import *
+from arpeggio import RegExMatch as _
+from arpeggio.peg import ParserPEG, grammar as peg_grammar, \
+    comment as peg_comment
+
+_EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, 'examples')
+
+
+def _example(name):
+    '''
+    Imports the example module. Examples which parse at import are not used.
+    '''
+    return imp.load_source('example_' + name,
+                           os.path.join(_EXAMPLES, name + '.py'))
+
+calc = _example('calc')
+json = _example('json')
+robot = _example('robot')
+
+
+# Language of examples/simple.py with comments.
+def comment():          return [_("//.*"), _("/\*.*?\*/")]
+def literal():          return _(r'\d*\.\d*|\d+|".*?"')
+def symbol():           return _(r"\w+")
+def operator():         return _(r"\+|\-|\*|\/|\=\=")
+def operation():        return symbol, operator, [literal, functioncall]
+def expression():       return [literal, operation, functioncall]
+def expressionlist():   return expression, ZeroOrMore(",", expression)
+def returnstatement():  return Kwd("return"), expression
+def ifstatement():      return Kwd("if"), "(", expression, ")", block, \
+                                Kwd("else"), block
+def statement():        return [ifstatement, returnstatement], ";"
+def block():            return "{", OneOrMore(statement), "}"
+def parameterlist():    return "(", symbol, ZeroOrMore(",", symbol), ")"
+def functioncall():     return symbol, "(", expressionlist, ")"
+def function():         return Kwd("function"), symbol, parameterlist, block
+def simpleLanguage():   return OneOrMore(function), EOF
+
+simple_input = '''
+    function fak(n) {
+        if (n==0) {
+            // For 0! result is 0
+            return 0;
+        } else { /* And for n>0 result is calculated recursively */
+            return n * fak(n - 1);
+        };
+    }
+'''
+
+robot_grammar = '''
+// Robot language
+program <- 'begin' (command)* 'end' EndOfFile;
+command <- UP/DOWN/LEFT/RIGHT; // one move
+UP <- 'up';
+DOWN <- 'down';
+LEFT <- 'left';
+RIGHT <- 'right';
+'''
+
+robot_input = '''
+    begin
+        up
+        up
+        left
+        down
+        right
+    end
+'''
+
+calc_grammar = r'''
+number <- r'\d*\.\d*|\d+';
+factor <- number / "(" expression ")";
+term <- factor (( "*" / "/") factor)*;
+expression <- ("+" / "-")? term (("+" / "-") term)*;
+calc <- expression EndOfFile;
+'''
+
+peg_input = open(os.path.join(_EXAMPLES, 'peg_peg.py')).read() \
+    .split('r"""')[1].split('"""')[0]
+
+json_input = '''
+{
+    "glossary": {
+        "title": "example glossary",
+        "GlossDiv": {
+            "title": "S",
+            "GlossList": [{"ID": "SGML", "SortAs": "SGML", "Size": -1.5e3},
+                          {"ID": "XML", "Empty": {}, "Flags": [true, false, null]}]
+        }
+    }
+}
+'''
+
+# (name, function creating the parser from the options, inputs)
+CASES = [
+    ('calc', lambda **kwargs: ParserPython(calc.calc, **kwargs),
+     ["-(4-1)*5+(2+4.67)+5.89/(.2+7)", "  3 * (4 + 5) ", "1+", "(1+2",
+      "1 2", ""]),
+    ('json', lambda **kwargs: ParserPython(json.jsonFile, **kwargs),
+     [json_input, '{}', '{"a": [[[[1]]]]}', '{"a": }', '{"a": [1,]}',
+      '{"x": "y" "z": 1}']),
+    ('robot', lambda **kwargs: ParserPython(robot.program, **kwargs),
+     [robot_input, "begin end", "begin up", "beginend"]),
+    ('simple', lambda **kwargs: ParserPython(simpleLanguage, comment,
+                                             **kwargs),
+     [simple_input, "function f(a) { return 1; }",
+      "function f(a) { return ; }", simple_input.replace("else", "els"),
+      "function f(a) { /* x */ if (1) {return 1;} }"]),
+    ('calc_peg', lambda **kwargs: ParserPEG(calc_grammar, 'calc', **kwargs),
+     ["-(4-1)*5+(2+4.67)+5.89/(.2+7)", "1+"]),
+    ('robot_peg', lambda **kwargs: ParserPEG(robot_grammar, 'program',
+                                             **kwargs),
+     [robot_input, "begin up down", "begin left"]),
+    ('peg', lambda **kwargs: ParserPython(peg_grammar, peg_comment, **kwargs),
+     [peg_input, robot_grammar, calc_grammar, "a <- b", "a <- ;",
+      "a <- (b / c d)* !e &f g?;"]),
+]
+
+
+def tree(node):
+    '''
+    @returns - the parse tree as nested tuples which can be compared.
+    '''
+    if node is None:
+        return None
+    comments = getattr(node, 'comments', None)
+    if isinstance(node, NonTerminal):
+        result = (node.type, node.position, [tree(n) for n in node.nodes])
+    else:
+        result = (node.type, node.position, node.value)
+    if comments is not None:
+        result += (tree(comments),)
+    return result
+
+
+def result(parse, _input):
+    '''
+    Parses the input with the given function.
+    @returns - the parse tree as nested tuples or the NoMatch report.
+    '''
+    try:
+        return tree(parse(_input))
+    except NoMatch, e:
+        return ('NoMatch', e.value, e.position)
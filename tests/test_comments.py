@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: test_comments.py
+# Purpose: Parsing of the inputs with comments
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#######################################################################
+
+import imp
+import unittest
+from arpeggio import *
+from arpeggio.codegen import generate
+from tests.grammars import simpleLanguage, comment, simple_input, result
+
+
+def terminals(node):
+    if isinstance(node, Terminal):
+        return [node]
+    return flatten([terminals(n) for n in node.nodes])
+
+
+class CommentsTest(unittest.TestCase):
+
+    def parsers(self):
+        yield ParserPython(simpleLanguage, comment)
+        yield ParserPython(simpleLanguage, comment, iterative=True)
+        module = imp.new_module('generated')
+        exec generate(ParserPython(simpleLanguage, comment)) \
+            in module.__dict__
+        yield module.GeneratedParser()
+
+    def test_comments_attached(self):
+        for parser in self.parsers():
+            parse_tree = parser.parse(simple_input)
+            comments = []
+            def walk(node):
+                if node.comments is not None:
+                    comments.extend(terminals(node.comments))
+                if isinstance(node, NonTerminal):
+                    for n in node.nodes:
+                        walk(n)
+            walk(parse_tree)
+            self.assertEqual([c.value for c in comments], [
+                "// For 0! result is 0",
+                "/* And for n>0 result is calculated recursively */"])
+
+    def test_nomatch_after_comments(self):
+        # Failure of the terminal tried again after the comments is not
+        # reported.
+        cases = [
+            ("function f(a) { /* c */ /* d */ retur 1; }", ('if', 16)),
+            ("function f(a) { // c\n if (a) { return 1; } }", (True, 27)),
+            (simple_input.replace("return 0;", "retrn 0;"), ('if', 55)),
+        ]
+        for parser in self.parsers():
+            for _input, (value, position) in cases:
+                self.assertEqual(result(parser.parse, _input), 
+                                 ('NoMatch', value, position))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: test_engines.py
+# Purpose: Parsing engines and options give the same results
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#######################################################################
+
+import imp
+import unittest
+import arpeggio
+from StringIO import StringIO
+from arpeggio import NoMatch, ParserPython, Memo, ArpeggioError
+from arpeggio.codegen import generate
+from arpeggio.stream import StreamInput
+from arpeggio.tracing import Tracer
+from tests.grammars import CASES, calc, result, tree
+
+
+class EnginesTest(unittest.TestCase):
+
+    def compare(self, parse=None, valid_only=False, **options):
+        '''
+        Compares the results of the parsers created with the given options
+        with the results of the parsers created with the default options.
+        @param parse - function (parser, input) parsing the input. Parser.parse 
+                        is used if not given.
+        @param valid_only - compare only the inputs which can be parsed.
+        '''
+        for name, make, inputs in CASES:
+            reference = make()
+            parser = make(**options)
+            for i, _input in enumerate(inputs):
+                expected = result(reference.parse, _input)
+                if valid_only and expected[0] == 'NoMatch':
+                    continue
+                if parse is None:
+                    actual = result(parser.parse, _input)
+                else:
+                    actual = result(lambda s: parse(parser, s), _input)
+                self.assertEqual(actual, expected, "%s input %d" % (name, i))
+
+    def test_iterative(self):
+        self.compare(iterative=True)
+
+    def test_not_regular(self):
+        self.compare(regular=False)
+
+    def test_not_optimized(self):
+        self.compare(optimize=False)
+
+    def test_not_predicted(self):
+        self.compare(predict=False)
+
+    def test_all_memoized(self):
+        self.compare(memo_analysis=False)
+
+    def test_left_factor(self):
+        # NoMatch reports may differ.
+        self.compare(valid_only=True, left_factor=True)
+
+    def test_flat(self):
+        self.compare(flat=True)
+
+    def test_sliced(self):
+        def parse(parser, _input):
+            sliced = parser.parse_sliced(_input, steps=7)
+            while not sliced.run():
+                pass
+            return sliced.parse_tree
+        self.compare(parse)
+
+    def test_stream(self):
+        # Input positions of NoMatch may differ as the input is dropped.
+        def parse(parser, _input):
+            return parser.parse(StreamInput(StringIO(_input), chunk_size=16,
+                                            lookahead=64))
+        self.compare(parse, valid_only=True)
+
+    def test_generated(self):
+        def parse(parser, _input):
+            module = imp.new_module('generated')
+            exec generate(parser) in module.__dict__
+            return module.GeneratedParser().parse(_input)
+        self.compare(parse)
+
+    def test_parse_many(self):
+        def parse(parser, _input):
+            ((parse_tree, error),) = parser.parse_many([_input], workers=1)
+            if error is not None:
+                raise error
+            return parse_tree
+        self.compare(parse)
+
+    def test_parse_many_unpicklable(self):
+        # Fails the same whether the workers are forked or not.
+        parser = ParserPython(calc.calc, memo=lambda: Memo())
+        self.assertRaises(ArpeggioError, parser.parse_many, ["1"], 
+                          workers=2)
+
+    def test_traced(self):
+        self.compare(tracer=Tracer())
+
+    def test_traced_model_unchanged(self):
+        # The parser model may be shared by the untraced parses.
+        class ClassTracer(Tracer):
+            def on_enter(self, parser, expression, position):
+                classes.add(type(expression))
+        classes = set()
+        for name, make, inputs in CASES:
+            parser = make(tracer=ClassTracer())
+            for _input in inputs:
+                result(parser.parse, _input)
+        self.assertTrue(classes)
+        self.assertTrue(all(getattr(arpeggio, cls.__name__, None) is cls
+                            for cls in classes), classes)
+
+    def test_reduce_tree(self):
+        for name, make, inputs in CASES:
+            reference = make(reduce_tree=True)
+            for options in [dict(iterative=True), dict(regular=False), 
+                            dict(flat=True)]:
+                parser = make(reduce_tree=True, **options)
+                for _input in inputs:
+                    self.assertEqual(result(parser.parse, _input),
+                                     result(reference.parse, _input), name)
+
+    def test_reused_parser(self):
+        # Parser keeps no state between the parses.
+        for name, make, inputs in CASES:
+            parser = make()
+            for _input in inputs + inputs[::-1]:
+                self.assertEqual(result(parser.parse, _input),
+                                 result(make().parse, _input), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: test_incremental.py
+# Purpose: Reparsing after edits gives the results of the new parse
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#######################################################################
+
+import pickle
+import random
+import unittest
+from arpeggio import *
+from arpeggio import IncrementalMemo, _position_slot
+from tests.grammars import CASES, json, result, tree
+
+
+def terminals(node):
+    if isinstance(node, Terminal):
+        return [node]
+    return flatten([terminals(n) for n in node.nodes])
+
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def test_random_edits(self):
+        self.random_edits(random.Random(1))
+
+    def test_small_chunks(self):
+        # Edits overlap several chunks of the memoization table.
+        chunk_size = IncrementalMemo.chunk_size
+        IncrementalMemo.chunk_size = 8
+        try:
+            self.random_edits(random.Random(2))
+        finally:
+            IncrementalMemo.chunk_size = chunk_size
+
+    def test_lazy_positions(self):
+        # Nodes after the edit are shifted when they are read.
+        items = ", ".join('{"id": %d}' % i for i in range(100))
+        text = '{"items": [%s]}' % items
+        parser = ParserPython(json.jsonFile, incremental=True)
+        old_tree = parser.parse(text)
+        last = terminals(old_tree)[-5]
+        self.assertEqual(last.value, '99')
+        position = last.position
+        start = text.index('0')
+        parse_tree = parser.reparse(start, 1, '12345')
+        self.assertTrue(any(n is last for n in terminals(parse_tree)))
+        self.assertNotEqual(_position_slot.__get__(last)[0], position + 4)
+        self.assertEqual(last.position, position + 4)
+        self.assertEqual(last.end, position + 6)
+        self.assertEqual(tree(parse_tree), tree(ParserPython(json.jsonFile)
+                                .parse(text.replace('0', '12345', 1))))
+        copy = pickle.loads(pickle.dumps(parse_tree, 2))
+        self.assertEqual(tree(copy), tree(parse_tree))
+        self.assertEqual(type(copy.nodes[0]), NonTerminal)
+
+    def random_edits(self, rand):
+        for name, make, inputs in CASES:
+            alphabet = "".join(set("".join(inputs)))
+            for options in [{}, dict(iterative=True), dict(reduce_tree=True)]:
+                reference = make(**options)
+                parser = make(incremental=True, **options)
+                text = inputs[0]
+                result(parser.parse, text)
+                for step in range(40):
+                    start = rand.randint(0, len(text))
+                    old_len = min(rand.choice([0, 1, 1, 2, 5]), 
+                                  len(text) - start)
+                    new_text = "".join(rand.choice(alphabet) for _ in 
+                                       range(rand.choice([0, 1, 1, 2, 4])))
+                    if rand.random() < 0.3:
+                        # Undo of the edit.
+                        new_text = text[start:start + old_len][::-1]
+                    text = text[:start] + new_text + text[start + old_len:]
+                    self.assertEqual(
+                        result(lambda s: parser.reparse(start, old_len, 
+                                                        new_text), text),
+                        result(reference.parse, text), 
+                        "%s %s step %d" % (name, options, step))
+
+    def test_regular_expression_results(self):
+        # Results of regular expressions must be invalidated by the edit
+        # after the matched text.
+        def R():    return [("a", OneOrMore("b"), "c"), "a"]
+        def item(): return ["b", "c", "d", ("(", item, ")")]
+        def root(): return R, ZeroOrMore(item), EOF
+        parser = ParserPython(root, incremental=True)
+        text = "a" + "b" * 2000 + "d"
+        parser.parse(text)
+        parse_tree = parser.reparse(len(text) - 1, 1, "c")
+        self.assertEqual([n.type for n in parse_tree.nodes], ['R', 'EOF'])
+
+
+if __name__ == '__main__':
+    unittest.main()
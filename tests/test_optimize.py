@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: test_optimize.py
+# Purpose: Optimized parser models give the same results
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#######################################################################
+
+import imp
+import random
+import unittest
+from arpeggio import *
+from arpeggio.codegen import generate
+from tests.grammars import result
+
+
+def random_grammar(rand):
+    '''
+    @returns - the root rule function of the random grammar of four rules.
+    '''
+    rules = []
+    bodies = []
+
+    def expression(d, rules):
+        k = rand.randint(0, 9 if d < 3 else 1)
+        if k <= 1:
+            return rand.choice('abc')
+        if k == 2 and rules:
+            return rand.choice(rules)
+        if k in (3, 4):
+            return tuple(expression(d + 1, rules) 
+                         for _ in range(rand.randint(1, 3)))
+        if k in (5, 6):
+            return [expression(d + 1, rules) 
+                    for _ in range(rand.randint(1, 3))]
+        if k == 9:
+            return Optional(expression(d + 1, rules))
+        # Repetition body always consumes input.
+        return rand.choice([ZeroOrMore, OneOrMore])(
+            (rand.choice('abc'), expression(d + 1, rules)))
+
+    for i in range(4):
+        def rule(i=i):
+            return bodies[i]
+        rule.__name__ = 'r%d' % i
+        rules.append(rule)
+    for i in range(4):
+        body = expression(0, rules[i + 1:])
+        if callable(body):
+            # Rule can't be just another rule. It can be a pass-through rule.
+            body = rand.choice([(body, "a"), [body], (body,)])
+        bodies.append(body)
+    def root():
+        return rules[0], EOF
+    return root
+
+
+class OptimizeTest(unittest.TestCase):
+
+    def test_nomatch_report(self):
+        def r():    return Optional("x"), ("b", "c")
+        def root(): return r, EOF
+        for regular in (False, True):
+            parser = ParserPython(root, regular=regular)
+            self.assertEqual(result(parser.parse, ""), ('NoMatch', 'x', 0))
+
+    def test_pass_through_rule(self):
+        def number(): return ["1", "2"]
+        def value():  return (number,)
+        def root():   return "=", value, EOF
+        for iterative in (False, True):
+            optimized = ParserPython(root, reduce_tree=True, 
+                                     iterative=iterative)
+            plain = ParserPython(root, reduce_tree=True, optimize=False,
+                                 iterative=iterative)
+            self.assertEqual(optimized.parser_model.nodes[1].rule, 'number')
+            for _input in ("=", "=3", "=1x"):
+                self.assertEqual(result(optimized.parse, _input),
+                                 result(plain.parse, _input))
+            self.assertEqual(result(optimized.parse, "=3"), 
+                             ('NoMatch', 'value', 1))
+
+        module = imp.new_module('generated')
+        exec generate(optimized) in module.__dict__
+        self.assertEqual(result(module.GeneratedParser().parse, "=3"), 
+                         ('NoMatch', 'value', 1))
+
+    def test_random_grammars(self):
+        rand = random.Random(1)
+        for i in range(200):
+            root = random_grammar(rand)
+            for options in [{}, dict(reduce_tree=True), 
+                            dict(memo_analysis=False)]:
+                optimized = ParserPython(root, **options)
+                plain = ParserPython(root, optimize=False, **options)
+                for j in range(10):
+                    _input = "".join(rand.choice('abc') for _ in 
+                                     range(rand.randint(0, 5)))
+                    self.assertEqual(result(optimized.parse, _input),
+                                     result(plain.parse, _input))
+
+
+if __name__ == '__main__':
+    unittest.main()
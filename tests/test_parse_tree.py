@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: test_parse_tree.py
+# Purpose: Parse tree nodes, flat trees and semantic analysis
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#######################################################################
+
+import pickle
+import unittest
+from StringIO import StringIO
+from arpeggio import *
+from arpeggio.flat import FlatTree
+from arpeggio.stream import StreamInput
+from tests.grammars import calc, comment, json, json_input, simpleLanguage, \
+    simple_input, tree
+
+
+class ParseTreeTest(unittest.TestCase):
+
+    def test_lazy_terminal_value(self):
+        parser = ParserPython(calc.calc, reduce_tree=True)
+        terminal = parser.parse("12 + 3").nodes[0].nodes[0]
+        self.assertTrue(isinstance(terminal, LazyTerminal))
+        self.assertEqual(terminal.value, '12')
+        terminal.value = '21'
+        self.assertEqual(terminal.value, '21')
+        self.assertEqual(str(terminal), '21')
+
+    def test_flat_pickle(self):
+        parser = ParserPython(json.jsonFile, flat=True)
+        parse_tree = parser.parse(json_input)
+        copy = pickle.loads(pickle.dumps(parse_tree.tree, 2))
+        self.assertEqual(tree(copy.node(copy.root)), tree(parse_tree))
+
+    def test_flat_large_positions(self):
+        # Positions of the input read from a file may not fit in an int.
+        offset = 2**40
+        parse_tree = ParserPython(calc.calc).parse("1 + 2")
+        flat = FlatTree()
+        flat._add(parse_tree, "1 + 2", 0)
+        flat.start[0] = offset
+        flat = pickle.loads(pickle.dumps(flat, 2))
+        self.assertEqual(flat.node(0).position, offset)
+
+    def test_getASG_parse_tree(self):
+        parser = ParserPython(calc.calc)
+        first = parser.parse("2 * 3")
+        parser.parse("1 + 1")
+        self.assertEqual(parser.getASG(parse_tree=first), 6.0)
+        self.assertEqual(parser.getASG(), 2.0)
+
+    def test_python_models(self):
+        parser = ParserPython(calc.calc)
+        other = ParserPython(calc.calc)
+        self.assertTrue(parser.parser_model is other.parser_model)
+        # Semantic actions are copied for each parser.
+        other.sem_actions['calc'] = SemanticAction()
+        parser.parse("1 + 2")
+        self.assertEqual(parser.getASG(), 3.0)
+
+        self.assertFalse(ParserPython(calc.calc, cache=False).parser_model 
+                         is parser.parser_model)
+        clear_models()
+        self.assertFalse(ParserPython(calc.calc).parser_model 
+                         is parser.parser_model)
+        self.assertEqual(parser.parse("2 * 3").type, 'calc')
+
+    def test_sem_set_after_model(self):
+        # Semantic actions set after the shared model is built.
+        def number():   return RegExMatch(r'\d+')
+        def root():     return number, EOF
+        ParserPython(root)
+        number.sem = calc.ToFloat()
+        root.sem = calc.Calc()
+        parser = ParserPython(root)
+        parser.parse("42")
+        self.assertEqual(parser.getASG(), 42.0)
+
+
+    def test_stream_terminals_detached(self):
+        # Items parsed before the first commit don't keep the first buffer.
+        parser = ParserPython(simpleLanguage, comment)
+        _input = simple_input * 4
+        expected = tree(parser.parse(_input))
+        parse_tree = parser.parse(StreamInput(StringIO(_input), 
+                                              chunk_size=64, lookahead=64))
+        self.assertEqual(tree(parse_tree), expected)
+        to_visit = [parse_tree]
+        while to_visit:
+            node = to_visit.pop()
+            if isinstance(node, NonTerminal):
+                to_visit.extend(node.nodes)
+            else:
+                self.assertFalse(isinstance(node, LazyTerminal), node.desc)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: test_peg.py
+# Purpose: Parsers created from the PEG grammars
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#######################################################################
+
+import unittest
+from arpeggio import *
+from arpeggio.peg import ParserPEG
+from tests.grammars import tree, result
+
+
+class PEGTest(unittest.TestCase):
+
+    def test_alias_rule(self):
+        # Rule which is just a reference to another rule.
+        grammar = 'a <- b EndOfFile; b <- c; c <- "x";'
+        parser = ParserPEG(grammar, 'a')
+        self.assertEqual(parser.parse("x").nodes[0].type, 'b')
+        self.assertEqual(result(parser.parse, "y"), ('NoMatch', 'a', 0))
+        parser = ParserPEG(grammar, 'a', reduce_tree=True)
+        self.assertEqual(parser.parse("x").nodes[0].type, 'c')
+
+
+if __name__ == '__main__':
+    unittest.main()
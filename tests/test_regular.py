@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: test_regular.py
+# Purpose: Matching of regular sub-grammars by a single regular expression
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#######################################################################
+
+import unittest
+from arpeggio import *
+from arpeggio import RegExMatch as _
+from tests.grammars import result
+
+
+class RegularTest(unittest.TestCase):
+
+    def compare(self, root, inputs, **options):
+        regular = ParserPython(root, **options)
+        plain = ParserPython(root, regular=False, **options)
+        self.assertTrue(regular._regular)
+        for _input in inputs:
+            self.assertEqual(result(regular.parse, _input),
+                             result(plain.parse, _input))
+
+    def test_digit_after_group(self):
+        # Backreference of the atomic group followed by a digit.
+        def first():  return ["x", "y"], "1", "2"
+        def other():  return "y", _(".*")
+        def root():   return [first, other], EOF
+        self.compare(root, ["y12", "x12", "y1"], skipws=False)
+        parse_tree = ParserPython(root, skipws=False).parse("y12")
+        self.assertEqual(parse_tree.nodes[0].type, 'first')
+
+    def test_digit_after_repetition(self):
+        def root():   return Optional("a"), "0", _(r"[a-z]+"), "5", EOF
+        self.compare(root, ["a0b5", "0bc5", "a0", "05"], skipws=False)
+
+    def test_whitespace(self):
+        def root():   return OneOrMore(["a", " b"]), Optional("c"), EOF
+        self.compare(root, ["a  b a c", " b b", "a c c"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#######################################################################
+# Name: test_whitespace.py
+# Purpose: Whitespace skipping
+# Author: Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# Copyright: (c) 2009 Igor R. Dejanović <igor DOT dejanovic AT gmail DOT com>
+# License: MIT License
+#######################################################################
+
+import unittest
+from arpeggio import ParserPython, EOF
+
+
+class CountingParser(ParserPython):
+    '''
+    Remembers the positions the whitespace is matched at.
+    '''
+    def _start(self, memo=None):
+        super(CountingParser, self)._start(memo)
+        match = self._ws_match
+        def counted(_input, position):
+            self.positions.append((_input, position))
+            return match(_input, position)
+        self._ws_match = counted
+
+
+class WhitespaceTest(unittest.TestCase):
+
+    def test_skipped_once(self):
+        # Whitespace run is matched once however many times the parser
+        # backtracks to it.
+        def statement(): return [("a", "b", "c"), ("a", "b", "d")], EOF
+        for options in [{}, dict(regular=False), dict(iterative=True),
+                        dict(regular=False, predict=False)]:
+            parser = CountingParser(statement, **options)
+            parser.positions = []
+            parser.parse(" a  b  d ")
+            self.assertTrue(parser.positions)
+            self.assertEqual(len(set(parser.positions)),
+                             len(parser.positions), options)
+
+
+if __name__ == '__main__':
+    unittest.main()